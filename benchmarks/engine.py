@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# engine.py - microbenchmarks for the hot paths of the engine
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Time the hot paths of the engine on deterministic game states.
+
+Every benchmark starts from a fresh maze of the same seed, with the
+global random module seeded too, and graphics go to SDL's dummy
+driver.  Each call is timed separately, after a setup which restores
+the state the call mutates, and the statistics are written as JSON
+so that results of different commits can be compared with --compare.
+"""
+
+import json
+import platform
+import random
+import re
+from argparse import ArgumentParser
+from functools import partial
+from math import pi
+from os import environ, path
+from statistics import mean, median
+from subprocess import PIPE, SubprocessError, run
+from sys import stderr, stdout
+from time import perf_counter_ns
+from types import SimpleNamespace
+
+environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from brutalmaze.constants import (  # noqa: E402
+    AROUND_HERO, BULLET_LIFETIME, CELL_WIDTH, EMPTY, ENEMY, ENEMIES,
+    INIT_SCORE, MIDDLE)
+from brutalmaze.maze import Maze    # noqa: E402
+from brutalmaze.weapons import Bullet   # noqa: E402
+
+SEED = 42
+FPS = 60
+SIZE = 640, 480
+ENEMY_COUNT = 16
+BULLET_COUNTS = 10, 100, 1000
+RESOLUTIONS = (320, 240), (640, 480), (1280, 720), (1920, 1080)
+MIN_TIME = 0.2  # s
+MAX_CALLS = 100000
+VERSION = 1
+
+
+def new_maze(size=SIZE, headless=True, enemies=ENEMY_COUNT):
+    """Return a maze of the benchmark's seed, with enough score
+    for the given number of enemies.
+    """
+    random.seed(SEED)
+    maze = Maze(FPS, size, headless, '', 1000 / FPS, seed=SEED)
+    maze.score = INIT_SCORE ** enemies
+    maze.add_enemy()
+    return maze
+
+
+def new_bullets(maze, count):
+    """Return the given number of bullets of random colors
+    spread over the display.
+    """
+    colors = ENEMIES + ['Aluminium']
+    return [Bullet(maze.surface, maze.rng.uniform(0, maze.w),
+                   maze.rng.uniform(0, maze.h), maze.rng.uniform(-pi, pi),
+                   maze.rng.choice(colors)) for _ in range(count)]
+
+
+def bench_new_map():
+    """Generate a new map."""
+    maze = new_maze()
+    return maze.new_map, None
+
+
+def bench_rotate():
+    """Rotate the maze by one grid, always in the same direction
+    so that a column is regenerated every CELL_WIDTH calls.
+    """
+    maze = new_maze()
+
+    def setup():
+        maze.centerx = maze.x + maze.distance*0.75
+
+    return maze.rotate, setup
+
+
+def bench_rotate_regenerate():
+    """Rotate the maze by the grid completing a cell,
+    which regenerates a column of cells.
+    """
+    maze = new_maze()
+
+    def setup():
+        maze.centerx = maze.x + maze.distance*0.75
+        maze.rotatex = CELL_WIDTH - 1
+
+    return maze.rotate, setup
+
+
+def bench_set_step():
+    """Find the path to the farthest empty grid on display."""
+    maze = new_maze()
+    destination = max(((x, y) for x in maze.rangex for y in maze.rangey
+                       if maze.map[x][y] == EMPTY),
+                      key=lambda grid: ((grid[0]-MIDDLE)**2
+                                        + (grid[1]-MIDDLE)**2, grid))
+
+    def setup():
+        random.seed(SEED)   # path finding shuffles neighbors
+        maze.destx, maze.desty = destination
+        maze.stepx = maze.stepy = 0
+
+    return partial(maze.set_step, maze.isdisplayed), setup
+
+
+def bench_track_bullets(count):
+    """Move the given number of bullets by a frame and handle hits."""
+    maze = new_maze()
+    bullets = new_bullets(maze, count)
+    states = [(b.x, b.y, maze.rng.uniform(0, BULLET_LIFETIME))
+              for b in bullets]
+
+    def setup():
+        for bullet, (x, y, fall_time) in zip(bullets, states):
+            bullet.x, bullet.y, bullet.fall_time = x, y, fall_time
+        maze.bullets = bullets.copy()
+        maze.hero.wounds[-1] = 0.0
+
+    return maze.track_bullets, setup
+
+
+def bench_slash():
+    """Spin the hero with awake enemies all around."""
+    maze = new_maze()
+    enemies = maze.enemies.copy()
+    grids = sorted(AROUND_HERO)
+
+    def setup():
+        maze.enemies = enemies.copy()
+        for enemy, (x, y) in zip(enemies, grids * len(enemies)):
+            enemy.x, enemy.y = x, y
+            enemy.alive = enemy.awake = True
+            enemy.wound = 0.0
+        maze.hero.spin_queue = maze.hero.spin_speed
+
+    return maze.slash, setup
+
+
+def bench_add_enemy():
+    """Spawn all enemies allowed by the score."""
+    maze = new_maze()
+
+    def setup(): maze.enemies = []
+
+    return maze.add_enemy, setup
+
+
+def bench_wake():
+    """Try waking every enemy up."""
+    maze = new_maze()
+    cells = [(enemy, maze.map[enemy.x][enemy.y]) for enemy in maze.enemies]
+
+    def setup():
+        for enemy, grid in cells:
+            enemy.awake = False
+            maze.map[enemy.x][enemy.y] = grid
+
+    def wake():
+        for enemy, grid in cells: enemy.wake()
+
+    return wake, setup
+
+
+def playing_maze(size=SIZE, headless=True):
+    """Return a maze with all enemies awake and bullets in flight."""
+    maze = new_maze(size, headless)
+    for enemy in maze.enemies:
+        enemy.awake = True
+        maze.map[enemy.x][enemy.y] = ENEMY
+    maze.bullets = new_bullets(maze, 20)
+    return maze
+
+
+def bench_update_export():
+    """Snapshot the maze with the displayed rows cached."""
+    maze = playing_maze()
+    return partial(maze.update_export, forced=True), None
+
+
+def bench_update_export_cold():
+    """Snapshot the maze after the displayed walls changed."""
+    maze = playing_maze()
+
+    def setup(): maze.rows = None
+
+    return partial(maze.update_export, forced=True), setup
+
+
+def bench_export_txt():
+    """Serialize the maze for the socket server."""
+    from brutalmaze.game import Game
+    maze = playing_maze()
+    return partial(Game.export_txt, SimpleNamespace(maze=maze)), None
+
+
+def bench_draw(size):
+    """Draw the maze on a display of the given size."""
+    import pygame
+    pygame.display.init()
+    maze = playing_maze(size, headless=False)
+    return maze.draw, None
+
+
+BENCHMARKS = {
+    'new_map': bench_new_map,
+    'rotate': bench_rotate,
+    'rotate[regenerate]': bench_rotate_regenerate,
+    'set_step': bench_set_step,
+    **{'track_bullets[{}]'.format(count): partial(bench_track_bullets, count)
+       for count in BULLET_COUNTS},
+    'slash': bench_slash,
+    'add_enemy': bench_add_enemy,
+    'Enemy.wake[{}]'.format(ENEMY_COUNT): bench_wake,
+    'update_export': bench_update_export,
+    'update_export[cold]': bench_update_export_cold,
+    'export_txt': bench_export_txt,
+    **{'draw[{}x{}]'.format(*size): partial(bench_draw, size)
+       for size in RESOLUTIONS}}
+
+
+def measure(call, setup, min_time=MIN_TIME, max_calls=MAX_CALLS):
+    """Return durations of calls (in ns), made until their total
+    reaches min_time (in s) or max_calls are made.
+    """
+    durations, total, limit = [], 0, min_time * 1e9
+    while total < limit and len(durations) < max_calls:
+        if setup is not None: setup()
+        start = perf_counter_ns()
+        call()
+        duration = perf_counter_ns() - start
+        durations.append(duration)
+        total += duration
+    return durations
+
+
+def commit():
+    """Return the hash of the commit checked out where this script is,
+    or None if it is not in a git checkout.
+    """
+    try:
+        return run(['git', 'rev-parse', 'HEAD'], stdout=PIPE, stderr=PIPE,
+                   check=True, universal_newlines=True,
+                   cwd=path.dirname(path.abspath(__file__))).stdout.strip()
+    except (OSError, ValueError, SubprocessError):
+        return None
+
+
+def compare(base, results):
+    """Print the ratio of each benchmark's median to its base."""
+    print('{:24} {:>12} {:>12} {:>7}'.format('', 'base (µs)', 'now (µs)',
+                                             'ratio'))
+    for name, stats in results.items():
+        if name not in base: continue
+        old, new = base[name]['median'], stats['median']
+        print('{:24} {:12.2f} {:12.2f} {:7.3f}'.format(
+            name, old / 1000, new / 1000, new / old))
+
+
+def main():
+    """Run the benchmarks and write the results."""
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='write results as JSON to the file'
+                        ' (default: stdout, or stderr with --compare)')
+    parser.add_argument('-t', '--min-time', type=float, default=MIN_TIME,
+                        metavar='SECONDS', help='time spent in each'
+                        ' benchmark (default: {})'.format(MIN_TIME))
+    parser.add_argument('-n', '--calls', type=int, metavar='N',
+                        help='make exactly N calls in each benchmark instead,'
+                        ' so that every run goes through the same states')
+    parser.add_argument('-k', '--filter', metavar='REGEX',
+                        help='only run benchmarks whose names match')
+    parser.add_argument('-c', '--compare', metavar='PATH',
+                        help='results to compare the medians against')
+    args = parser.parse_args()
+
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if args.filter and not re.search(args.filter, name): continue
+        call, setup = bench()
+        call()  # warm up caches
+        if args.calls is None:
+            durations = measure(call, setup, args.min_time)
+        else:
+            durations = measure(call, setup, float('inf'), args.calls)
+        results[name] = {'calls': len(durations), 'min': min(durations),
+                         'median': median(durations),
+                         'mean': mean(durations)}
+
+    report = {'version': VERSION, 'commit': commit(), 'seed': SEED,
+              'python': platform.python_version(),
+              'machine': platform.machine(), 'unit': 'ns',
+              'results': results}
+    if args.output is None:
+        # Keep stdout for the comparison table alone when there is one.
+        print(json.dumps(report, indent=2),
+              file=stdout if args.compare is None else stderr)
+    else:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f: compare(json.load(f)['results'], results)
+
+
+if __name__ == '__main__': main()
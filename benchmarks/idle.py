@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# idle.py - CPU usage of an idle headless server
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Measure the CPU time a headless server spends while no client
+is connected.
+
+The server is started, left alone for the given duration once it is
+listening, then terminated.  Its CPU time is read from /proc before
+and after the idle period, so that start-up is not counted; where /proc
+is not available, the total from its resource usage is reported instead.
+"""
+
+from argparse import ArgumentParser
+from os import sysconf, wait4
+from subprocess import PIPE, Popen
+from sys import executable
+from time import monotonic, sleep
+
+PORT = 42069
+DURATION = 10.0     # s
+
+
+def cpu_time(pid):
+    """Return the user and system time of the process (in s),
+    or None if it is not available.
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            # The command name may contain spaces but not parentheses.
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / sysconf('SC_CLK_TCK')
+
+
+def main():
+    """Run an idle server and print its CPU usage."""
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-p', '--port', type=int, default=PORT,
+                        help='port of the server (default: {})'.format(PORT))
+    parser.add_argument('-d', '--duration', type=float, default=DURATION,
+                        metavar='SECONDS', help='time to stay idle for'
+                        ' (default: {})'.format(DURATION))
+    parser.add_argument('--max-fps', type=int,
+                        help='maximum FPS of the server')
+    args = parser.parse_args()
+
+    command = [executable, '-m', 'brutalmaze.game', '--server', '--headless',
+               '--port', str(args.port)]
+    if args.max_fps is not None: command += '--max-fps', str(args.max_fps)
+    server = Popen(command, stdout=PIPE, universal_newlines=True)
+    try:
+        for line in server.stdout:
+            if line.startswith('Socket server is listening'): break
+        start, before = monotonic(), cpu_time(server.pid)
+        sleep(args.duration)
+        after, elapsed = cpu_time(server.pid), monotonic() - start
+    finally:
+        server.terminate()
+        usage = wait4(server.pid, 0)[2]
+        server.stdout.close()
+
+    if before is None or after is None:
+        spent, what = usage.ru_utime + usage.ru_stime, 'in total'
+    else:
+        spent, what = after - before, 'while idle'
+    print('CPU time {}: {:.3f} s over {:.1f} s ({:.1f}% of a core)'.format(
+        what, spent, elapsed, spent / elapsed * 100))
+
+
+if __name__ == '__main__': main()
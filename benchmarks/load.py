@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# load.py - load generator for the socket server
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Load local socket servers with many concurrent clients and report
+their throughput and latencies.
+
+Clients speak the same protocol as client-examples/hit-and-run.py:
+each observation is prefixed by its length in seven digits, and each
+action is sent back as seven bytes of move, angle and attack.
+Since a server plays one session at a time, the clients are spread
+over the given ports, and those waiting for a busy server count
+towards the latency of their first observation.  With --spawn,
+that many headless servers are started on consecutive ports.
+"""
+
+import asyncio
+from argparse import ArgumentParser
+from math import atan2, degrees, hypot
+from random import Random
+from subprocess import DEVNULL, Popen
+from sys import executable
+from time import perf_counter
+
+HOST = 'localhost'
+PORT = 42069
+CLIENTS = 8
+DURATION = 10.0     # s
+FRAMES = 600    # per session
+CONNECT_TIMEOUT = 10.0  # s
+READ_TIMEOUT = 10.0     # s
+
+
+def parse(data):
+    """Return the hero's position and the enemies' positions
+    from an observation.
+    """
+    lines = data.decode().split('\n')
+    rows, enemies = map(int, lines[0].split()[:2])
+    hero = lines[rows + 1].split()
+    return ((int(hero[1]), int(hero[2])),
+            [tuple(map(int, line.split()[1:3]))
+             for line in lines[rows+2:rows+2+enemies]])
+
+
+def random_policy(data, rng):
+    """Move, aim and attack at random."""
+    return rng.randrange(9), rng.randrange(360), rng.randrange(4)
+
+
+def still_policy(data, rng):
+    """Stand still, doing nothing."""
+    return 4, 0, 0
+
+
+def aim_policy(data, rng):
+    """Wander around and shoot the nearest enemy."""
+    (hx, hy), enemies = parse(data)
+    if not enemies: return rng.randrange(9), rng.randrange(360), 0
+    x, y = min(enemies, key=lambda e: hypot(e[0] - hx, e[1] - hy))
+    return rng.randrange(9), round(degrees(atan2(y - hy, x - hx))) % 360, 1
+
+
+POLICIES = {'random': random_policy, 'still': still_policy,
+            'aim': aim_policy}
+
+
+def percentiles(values):
+    """Return the 50th, 90th, 99th percentile and maximum
+    of the values in ms.
+    """
+    values = sorted(values)
+    if not values: return 0.0, 0.0, 0.0, 0.0
+    n = len(values)
+    return tuple(values[min(n * p // 100, n - 1)] * 1000
+                 for p in (50, 90, 99, 100))
+
+
+class Stats:
+    """Measurements gathered by all clients.
+
+    Attributes:
+        sessions (int): sessions finished
+        frames (int): observations received
+        errors (int): sessions ended by an error
+        first (list of float): delays from connecting
+            to the first observation (in s)
+        turnaround (list of float): delays from sending an action
+            to receiving the next observation (in s)
+        think (list of float): delays from receiving an observation
+            to sending the action (in s)
+    """
+    def __init__(self):
+        self.sessions = self.frames = self.errors = 0
+        self.first, self.turnaround, self.think = [], [], []
+
+
+async def read(reader, timeout=READ_TIMEOUT):
+    """Return the next observation, or None if the game is over."""
+    length = int(await asyncio.wait_for(reader.readexactly(7), timeout))
+    if not length: return None
+    return await asyncio.wait_for(reader.readexactly(length), timeout)
+
+
+async def session(host, port, policy, rng, frames, stats):
+    """Play a session until the hero dies or the given number
+    of frames is played.
+    """
+    start = perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        data = await read(reader)
+        stats.first.append(perf_counter() - start)
+        for _ in range(frames):
+            if data is None: break
+            stats.frames += 1
+            received = perf_counter()
+            action = '{} {} {}'.format(*policy(data, rng))
+            writer.write(action.ljust(7).encode())
+            sent = perf_counter()
+            stats.think.append(sent - received)
+            data = await read(reader)
+            stats.turnaround.append(perf_counter() - sent)
+        stats.sessions += 1
+    finally:
+        writer.close()
+
+
+async def client(address, policy, rng, frames, deadline, stats):
+    """Play sessions back-to-back until the deadline."""
+    loop = asyncio.get_running_loop()
+    while loop.time() < deadline:
+        try:
+            await session(*address, policy, rng, frames, stats)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError,
+                ValueError):
+            stats.errors += 1
+            await asyncio.sleep(0.1)
+
+
+async def wait_servers(addresses, timeout=CONNECT_TIMEOUT):
+    """Wait until every spawned server accepts connections."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    for host, port in addresses:
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+            except OSError:
+                if loop.time() > deadline: raise
+                await asyncio.sleep(0.1)
+            else:
+                # The server accepted this probe as a session, which
+                # ends without error once its observation is read.
+                await read(reader)
+                writer.close()
+                break
+
+
+async def load(addresses, clients, policy, frames, duration, seed):
+    """Run the clients for the given duration and return the stats
+    and the time elapsed.
+    """
+    stats, loop = Stats(), asyncio.get_running_loop()
+    start = loop.time()
+    await asyncio.gather(*(
+        client(addresses[i % len(addresses)], policy, Random(seed + i),
+               frames, start + duration, stats) for i in range(clients)))
+    return stats, loop.time() - start
+
+
+def main():
+    """Generate load and print the results."""
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default=HOST,
+                        help='host of the servers (default: {})'.format(HOST))
+    parser.add_argument('-p', '--ports', type=int, nargs='+', default=[PORT],
+                        metavar='PORT', help='ports of the servers'
+                        ' (default: {})'.format(PORT))
+    parser.add_argument('-s', '--spawn', type=int, default=0, metavar='N',
+                        help='start N headless servers on consecutive ports'
+                        ' from the first one')
+    parser.add_argument('--max-fps', type=int,
+                        help='maximum FPS of spawned servers')
+    parser.add_argument('-c', '--clients', type=int, default=CLIENTS,
+                        help='concurrent clients (default: {})'.format(
+                            CLIENTS))
+    parser.add_argument('-P', '--policy', choices=POLICIES, default='aim',
+                        help='how clients play (default: aim)')
+    parser.add_argument('-f', '--frames', type=int, default=FRAMES,
+                        help='maximum frames per session (default: {})'
+                        .format(FRAMES))
+    parser.add_argument('-d', '--duration', type=float, default=DURATION,
+                        metavar='SECONDS', help='time to generate load for'
+                        ' (default: {})'.format(DURATION))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the clients (default: 0)')
+    args = parser.parse_args()
+
+    ports, servers = args.ports, []
+    if args.spawn:
+        ports = list(range(ports[0], ports[0] + args.spawn))
+        command = [executable, '-m', 'brutalmaze.game', '--server',
+                   '--headless', '--host', args.host]
+        if args.max_fps is not None: command += '--max-fps', str(args.max_fps)
+        servers = [Popen(command + ['--port', str(port)], stdout=DEVNULL)
+                   for port in ports]
+    addresses = [(args.host, port) for port in ports]
+    try:
+        if servers: asyncio.run(wait_servers(addresses))
+        stats, elapsed = asyncio.run(load(
+            addresses, args.clients, POLICIES[args.policy],
+            args.frames, args.duration, args.seed))
+    finally:
+        for server in servers: server.terminate()
+        for server in servers: server.wait()
+
+    print('servers:    {}'.format(len(addresses)))
+    print('clients:    {}'.format(args.clients))
+    print('sessions/s: {:.2f} ({} sessions, {} errors)'.format(
+        stats.sessions / elapsed, stats.sessions, stats.errors))
+    print('frames/s:   {:.1f} ({} frames)'.format(stats.frames / elapsed,
+                                                  stats.frames))
+    print('{:12} {:>9} {:>9} {:>9} {:>9}'.format('latency (ms)', 'p50',
+                                                 'p90', 'p99', 'max'))
+    for name in 'first', 'turnaround', 'think':
+        print('{:12} {:9.3f} {:9.3f} {:9.3f} {:9.3f}'.format(
+            name, *percentiles(getattr(stats, name))))
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# soak.py - soak test tracking the memory of long-running games
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Play headless games back-to-back with a built-in bot and fail
+if memory keeps growing.
+
+The resident set size and tracemalloc's traced memory are sampled
+on an interval.  The first sample, taken after a warm-up, is the
+baseline: the report lists the allocation sites which grew the most
+since then, and the test fails if the RSS grew past the threshold.
+Games can be recorded as well, so that the writers are soaked too.
+"""
+
+import tracemalloc
+from argparse import ArgumentParser
+from math import atan2, hypot
+from os import sysconf
+from random import Random
+from resource import RUSAGE_SELF, getrusage
+from sys import exit
+from tempfile import TemporaryDirectory
+from time import monotonic
+
+from brutalmaze.maze import Maze
+from brutalmaze.records import WRITERS
+
+SEED = 42
+FPS = 30
+SIZE = 640, 480
+DURATION = 3600.0   # s
+INTERVAL = 60.0     # s
+WARM_UP = 60.0  # s
+MAX_GROWTH = 64.0   # MiB
+TOP = 10    # allocation sites reported
+MIB = 1 << 20
+DIRECTIONS = [(x, y) for x in (-1, 0, 1) for y in (-1, 0, 1)]
+TURN = 0.05     # probability of changing direction each frame
+
+
+def rss():
+    """Return the current resident set size (in bytes),
+    or the peak one where the current one is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+
+def bot(maze, direction):
+    """Control the hero for a frame, moving in the given direction
+    and shooting the nearest awake enemy, or slashing it if it is close.
+    """
+    enemies = [enemy for enemy in maze.enemies if enemy.awake]
+    if not enemies:
+        maze.control(*direction, maze.hero.angle, False, False)
+        return
+    x, y = min((enemy.pos for enemy in enemies),
+               key=lambda pos: hypot(pos[0] - maze.x, pos[1] - maze.y))
+    close = hypot(x - maze.x, y - maze.y) < maze.distance * 2
+    maze.control(*direction, atan2(y - maze.y, x - maze.x), not close, close)
+
+
+class Soak:
+    """Back-to-back games sampled for memory usage.
+
+    Attributes:
+        maze (Maze): the maze being played
+        rng (random.Random): generator of the bot's decisions
+        direction (tuple of int): direction the bot is heading to
+        games (int): games finished
+        ticks (int): frames played
+        samples (list of tuple): time, games, ticks, RSS
+            and traced memory at each sample
+        baseline (tracemalloc.Snapshot): snapshot of the first sample
+    """
+    def __init__(self, export_dir='', export_format='json', seed=SEED):
+        self.maze = Maze(FPS, SIZE, True, export_dir, 1000 / FPS,
+                         export_format, seed)
+        self.rng, self.direction = Random(seed), (0, 0)
+        self.games = self.ticks = 0
+        self.samples, self.baseline = [], None
+
+    def play(self, until):
+        """Play until the given monotonic time."""
+        maze = self.maze
+        while monotonic() < until:
+            if maze.hero.dead:
+                self.games += 1
+                maze.reinit()
+            if self.rng.random() < TURN:
+                self.direction = self.rng.choice(DIRECTIONS)
+            bot(maze, self.direction)
+            maze.update(FPS)
+            self.ticks += 1
+
+    def sample(self, time):
+        """Record the memory usage at the given time since start."""
+        self.samples.append((time, self.games, self.ticks, rss(),
+                             tracemalloc.get_traced_memory()[0]))
+        if self.baseline is None:
+            self.baseline = tracemalloc.take_snapshot()
+
+    def growth(self):
+        """Return the growth of the RSS since the first sample
+        (in bytes).
+        """
+        return self.samples[-1][3] - self.samples[0][3]
+
+    def report(self, top=TOP):
+        """Return the samples and the allocation sites which grew
+        the most since the first sample, as lines of text.
+        """
+        lines = ['{:>9} {:>7} {:>10} {:>9} {:>11}'.format(
+            'time (s)', 'games', 'ticks', 'RSS (MiB)', 'traced (MiB)')]
+        lines.extend('{:9.0f} {:7} {:10} {:9.1f} {:11.1f}'.format(
+            time, games, ticks, rss / MIB, traced / MIB)
+            for time, games, ticks, rss, traced in self.samples)
+        lines.append('')
+        lines.append('Top {} growing allocation sites:'.format(top))
+        stats = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),)).compare_to(
+                self.baseline, 'lineno')
+        lines.extend(str(stat) for stat in stats[:top] if stat.size_diff > 0)
+        return lines
+
+
+def main():
+    """Run the soak test and exit with failure if memory grew
+    past the threshold.
+    """
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-d', '--duration', type=float, default=DURATION,
+                        metavar='SECONDS', help='time to play for, after'
+                        ' the warm-up (default: {})'.format(DURATION))
+    parser.add_argument('-i', '--interval', type=float, default=INTERVAL,
+                        metavar='SECONDS', help='time between samples'
+                        ' (default: {})'.format(INTERVAL))
+    parser.add_argument('-w', '--warm-up', type=float, default=WARM_UP,
+                        metavar='SECONDS', help='time to play before the'
+                        ' first sample (default: {})'.format(WARM_UP))
+    parser.add_argument('-m', '--max-growth', type=float, default=MAX_GROWTH,
+                        metavar='MIB', help='RSS growth to fail at'
+                        ' (default: {})'.format(MAX_GROWTH))
+    parser.add_argument('-r', '--record-format', choices=WRITERS,
+                        help='also record the games in a temporary'
+                        ' directory in the given format')
+    parser.add_argument('-t', '--traceback', type=int, default=1,
+                        metavar='FRAMES', help='frames traced for each'
+                        ' allocation (default: 1)')
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='also write the report to the file')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='seed of the games (default: {})'.format(SEED))
+    args = parser.parse_args()
+
+    tracemalloc.start(args.traceback)
+    with TemporaryDirectory() as directory:
+        soak = Soak(directory if args.record_format else '',
+                    args.record_format or 'json', args.seed)
+        start = monotonic()
+        soak.play(start + args.warm_up)
+        end = monotonic() + args.duration
+        while True:
+            now = monotonic()
+            soak.sample(now - start)
+            print('{:.0f} s: {} games, {} ticks, RSS {:.1f} MiB'.format(
+                *soak.samples[-1][:3], soak.samples[-1][3] / MIB), flush=True)
+            if now >= end: break
+            soak.play(min(now + args.interval, end))
+        soak.maze.close()
+    lines = soak.report()
+    lines.append('')
+    growth = soak.growth() / MIB
+    lines.append('RSS grew by {:.1f} MiB (threshold: {} MiB)'.format(
+        growth, args.max_growth))
+    print(*lines, sep='\n')
+    if args.output is not None:
+        with open(args.output, 'w') as f: print(*lines, sep='\n', file=f)
+    if growth > args.max_growth: exit(1)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# startup.py - benchmark for the start-up time of headless simulation
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Measure how long a fresh worker process takes from interpreter
+start to a headless maze that has been played for a few frames.
+
+Each sample is run in a new interpreter so that nothing is cached
+in sys.modules.  Heavy modules that got imported along the way
+are reported, since the simulation is not supposed to need any
+of them.
+"""
+
+from argparse import ArgumentParser
+from statistics import median
+from subprocess import PIPE, run
+from sys import executable
+from time import perf_counter
+
+SCRIPT = '''
+from sys import modules
+from time import perf_counter
+start = perf_counter()
+from brutalmaze.maze import Maze
+imported = perf_counter()
+maze = Maze(30, (640, 480), True, '', 1000 / 30)
+for _ in range({}): maze.update(30)
+played = perf_counter()
+heavy = [m for m in ('pygame', 'palace', 'pkg_resources', 'numpy')
+         if m in modules]
+print(imported - start, played - imported, ','.join(heavy))
+'''
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=10,
+                        help='number of processes to sample (default: 10)')
+    parser.add_argument('-f', '--frames', type=int, default=30,
+                        help='frames to play in each sample (default: 30)')
+    args = parser.parse_args()
+
+    totals, imports, plays, heavy = [], [], [], set()
+    for _ in range(args.repeat):
+        start = perf_counter()
+        output = run([executable, '-c', SCRIPT.format(args.frames)],
+                     stdout=PIPE, stderr=PIPE, check=True,
+                     universal_newlines=True).stdout
+        totals.append(perf_counter() - start)
+        imported, played, modules = output.split(' ')
+        imports.append(float(imported))
+        plays.append(float(played))
+        heavy.update(filter(None, modules.strip().split(',')))
+
+    print('process total: {:8.2f} ms'.format(median(totals) * 1000))
+    print('import:        {:8.2f} ms'.format(median(imports) * 1000))
+    print('{} frames:     {:8.2f} ms'.format(args.frames,
+                                             median(plays) * 1000))
+    print('heavy modules: {}'.format(', '.join(sorted(heavy)) or 'none'))
+
+
+if __name__ == '__main__': main()
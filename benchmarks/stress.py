@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# stress.py - scaling scenarios for large numbers of enemies and bullets
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Play headless scenarios with many enemies and bullets and report
+how the cost of a tick scales with them.
+
+Normal play caps the number of enemies by the logarithm of the score,
+so each scenario forces the score and spawns N awake enemies of the
+chosen colors on the displayed walls, while those killed are respawned
+by the game in random colors.  Bullets are topped up to M
+in flight before every tick, outside of the timing, and the hero
+is kept alive, spinning around and shooting.  Each scenario is played
+twice from the same seed: once for timing and once under tracemalloc
+for the peak memory, since tracing slows everything down.
+"""
+
+import json
+import tracemalloc
+from argparse import ArgumentParser
+from itertools import product
+from math import pi
+from statistics import mean
+from time import perf_counter_ns
+
+from brutalmaze.characters import new_enemy
+from brutalmaze.constants import ENEMIES, ENEMY, INIT_SCORE, WALL
+from brutalmaze.maze import Maze
+from brutalmaze.weapons import Bullet
+
+SEED = 42
+FPS = 60
+SIZE = 640, 480
+ENEMY_COUNTS = 0, 16, 64, 256
+BULLET_COUNTS = 0, 100, 1000
+TICKS = 300
+
+
+def new_scenario(enemies, bullets, colors, score=None):
+    """Return a maze with the given number of awake enemies
+    of the given colors, and a function topping up its bullets.
+    """
+    maze = Maze(FPS, SIZE, True, '', 1000 / FPS, seed=SEED)
+    maze.score = INIT_SCORE ** enemies if score is None else score
+    walls = [(x, y) for x in maze.rangex for y in maze.rangey
+             if maze.map[x][y] == WALL]
+    maze.enemies = []
+    for i in range(enemies):
+        # Enemies share grids once the walls on display run out.
+        x, y = maze.rng.choice(walls)
+        enemy = new_enemy(maze, x, y, colors[i % len(colors)])
+        enemy.awake = True
+        maze.map[x][y] = ENEMY
+        maze.enemies.append(enemy)
+    maze.rows = None
+
+    def reload():
+        for _ in range(bullets - len(maze.bullets)):
+            maze.bullets.append(Bullet(
+                None, maze.rng.uniform(0, maze.w), maze.rng.uniform(0, maze.h),
+                maze.rng.uniform(-pi, pi), maze.rng.choice(colors)))
+
+    return maze, reload
+
+
+def play(maze, reload, ticks):
+    """Play the maze for the given number of ticks
+    and return the duration of each (in ns).
+    """
+    durations, hero = [], maze.hero
+    for tick in range(ticks):
+        reload()
+        hero.wound, hero.wounds[-1] = 0.0, 0.0
+        maze.control(0, 0, tick * pi / FPS, True, False)
+        start = perf_counter_ns()
+        maze.update(FPS)
+        durations.append(perf_counter_ns() - start)
+    return durations
+
+
+def run(enemies, bullets, colors, ticks, score=None, memory=True):
+    """Run the scenario and return its statistics."""
+    durations = play(*new_scenario(enemies, bullets, colors, score), ticks)
+    durations.sort()
+    stats = {'enemies': enemies, 'bullets': bullets,
+             'ms/tick': mean(durations) / 1e6,
+             'p95': durations[len(durations) * 19 // 20] / 1e6}
+    if memory:
+        tracemalloc.start()
+        play(*new_scenario(enemies, bullets, colors, score), ticks)
+        stats['peak KiB'] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    return stats
+
+
+def main():
+    """Run the scenarios and print their statistics."""
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-e', '--enemies', type=int, nargs='+',
+                        default=ENEMY_COUNTS, metavar='N',
+                        help='numbers of enemies (default: {})'.format(
+                            ' '.join(map(str, ENEMY_COUNTS))))
+    parser.add_argument('-b', '--bullets', type=int, nargs='+',
+                        default=BULLET_COUNTS, metavar='M',
+                        help='numbers of bullets in flight (default: {})'
+                        .format(' '.join(map(str, BULLET_COUNTS))))
+    parser.add_argument('-c', '--colors', nargs='+', default=ENEMIES,
+                        choices=ENEMIES, metavar='COLOR',
+                        help='colors of enemies and their bullets, taken'
+                        ' in turn (default: all)')
+    parser.add_argument('-s', '--score', type=float,
+                        help='forced score (default: just enough for N'
+                        ' enemies to be respawned)')
+    parser.add_argument('-t', '--ticks', type=int, default=TICKS,
+                        help='ticks in each scenario (default: {})'.format(
+                            TICKS))
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip measuring the peak memory')
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='also write the statistics as JSON')
+    args = parser.parse_args()
+
+    score = None if args.score is None else args.score + INIT_SCORE
+    results = []
+    print('{:>7} {:>7} {:>9} {:>9} {:>9} {:>10}'.format(
+        'enemies', 'bullets', 'ms/tick', 'p95', 'µs/each', 'peak KiB'))
+    for enemies, bullets in product(args.enemies, args.bullets):
+        stats = run(enemies, bullets, args.colors, args.ticks,
+                    score, args.memory)
+        results.append(stats)
+        # The cost per enemy or bullet stays flat while scaling
+        # is linear and grows where it goes superlinear.
+        each = stats['ms/tick'] * 1000 / (enemies+bullets or 1)
+        print('{:7} {:7} {:9.3f} {:9.3f} {:9.2f} {:>10}'.format(
+            enemies, bullets, stats['ms/tick'], stats['p95'], each,
+            '{:.0f}'.format(stats['peak KiB']) if args.memory else ''))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'seed': SEED, 'ticks': args.ticks,
+                       'colors': args.colors, 'results': results},
+                      f, indent=2)
+
+
+if __name__ == '__main__': main()
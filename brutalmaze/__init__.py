@@ -1,3 +1,3 @@
 """Minimalist thrilling shoot 'em up game with minimalist art style"""
 
-from .game import __version__
+__version__ = '0.9.2'
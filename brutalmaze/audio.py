@@ -0,0 +1,152 @@
+# audio.py - module for sound effects
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for sound effects'
+
+from math import hypot
+
+from .constants import (
+    MIDDLE, SFX, SFX_SPAWN, SFX_SLASH_ENEMY, SFX_SLASH_HERO,
+    SFX_SHOT_ENEMY, SFX_SHOT_HERO, SFX_MISSED, SFX_HEART, SFX_LOSE, pkg_file)
+from .worker import Worker
+
+VOICES = 16
+MIN_GAIN = 1 / 64
+# Sounds about the hero matter more than the ones about enemies.
+PRIORITIES = {SFX_LOSE: 5, SFX_HEART: 4, SFX_SHOT_HERO: 3, SFX_MISSED: 3,
+              SFX_SLASH_HERO: 2, SFX_SLASH_ENEMY: 2,
+              SFX_SHOT_ENEMY: 1, SFX_SPAWN: 1}
+
+
+class NullMixer:
+    """Audio manager playing nothing, used when the game is run
+    headlessly so that simulation never pays for sound.
+    """
+    def play(self, sound, x=MIDDLE, y=MIDDLE, gain=1.0): return None
+
+    def loop(self, sound): return None
+
+    def update(self): pass
+
+    def destroy(self): pass
+
+
+class Mixer:
+    """Audio manager playing preloaded sound effects through a fixed
+    pool of sources.
+
+    When every source is busy, the one playing the least important
+    sound is stolen, unless the new sound is even less important.
+    All calls to the audio library are made from a background worker,
+    which drops requests instead of blocking the caller when it falls
+    behind.
+
+    Attributes:
+        worker (Worker): the thread doing all audio work
+        context (palace.Context): the audio context in use
+        buffers (dict of palace.Buffer): preloaded sound effects
+        sources (list of palace.Source): pool of voices
+        priorities (list of tuple): priority and audible gain
+            of the sound played by each source
+        music (palace.Source): source dedicated to the looping noise
+    """
+    def __init__(self, voices=VOICES):
+        from palace import use_context, Buffer, Context, Device, Source
+        self.worker = Worker(voices, 'audio')
+        self.context = Context(Device())
+        use_context(self.context)
+        self.context.listener.position = MIDDLE, -MIDDLE, 0
+        self.buffers = {sfx: Buffer(pkg_file(sfx)) for sfx in SFX}
+        self.sources = [Source() for _ in range(voices)]
+        self.priorities = [(0, 0.0)] * voices
+        self.music = Source()
+
+    @property
+    def gain(self):
+        """Master gain."""
+        return self.context.listener.gain
+
+    @gain.setter
+    def gain(self, value):
+        self.context.listener.gain = value
+
+    def play(self, sound, x=MIDDLE, y=MIDDLE, gain=1.0):
+        """Schedule a sound to be played at the given position
+        unless it is inaudible.
+        """
+        # Sources are spatialized with the inverse distance model.
+        audible = gain / max(hypot(x - MIDDLE, y - MIDDLE), 1.0)
+        if audible < MIN_GAIN: return None
+        self.worker.submit(self.start, sound, x, y, gain,
+                           (PRIORITIES.get(sound, 0), audible), block=False)
+
+    def start(self, sound, x, y, gain, priority):
+        """Play a sound at the given position and return the source
+        playing it, or None if every voice is busy with more important
+        sounds.
+        """
+        for i, source in enumerate(self.sources):
+            if not source.playing: break
+        else:
+            i = min(range(len(self.sources)), key=self.priorities.__getitem__)
+            if self.priorities[i] >= priority: return None
+            source = self.sources[i]
+            source.stop()
+        self.priorities[i] = priority
+        source.spatialize = True
+        source.position = x, -y, 0
+        source.gain = gain
+        return self.buffers[sound].play(source)
+
+    def loop(self, sound):
+        """Play the given sound repeatedly on the dedicated source."""
+        self.music.looping = True
+        self.worker.submit(self.buffers[sound].play, self.music)
+
+    def update(self):
+        """Schedule an update of the audio context."""
+        self.worker.submit(self.context.update, block=False)
+
+    def destroy(self):
+        """Release all audio resources."""
+        self.worker.close()
+        from palace import free, use_context
+        for source in (self.music, *self.sources):
+            source.stop()
+            source.destroy()
+        self.context.update()
+        free([pkg_file(sfx) for sfx in SFX])
+        use_context(None)
+        self.context.destroy()
+        self.context.device.close()
+
+
+_mixer = NullMixer()
+
+
+def use_mixer(mixer):
+    """Make the given audio manager play all following sounds."""
+    global _mixer
+    _mixer = mixer
+
+
+def play(sound, x=MIDDLE, y=MIDDLE, gain=1.0):
+    """Play a sound at the given position using the current audio
+    manager.
+    """
+    return _mixer.play(sound, x, y, gain)
@@ -20,14 +20,14 @@ __doc__ = 'Brutal Maze module for hero and enemy classes'
 
 from collections import deque
 from math import atan2, gcd, sin, pi
-from random import choice, randrange, shuffle
 from sys import modules
 
+from .audio import play
 from .constants import (
     TANGO, HERO_HP, SFX_HEART, HEAL_SPEED, MIN_BEAT, ATTACK_SPEED, ENEMY,
     ENEMY_SPEED, ENEMY_HP, SFX_SPAWN, SFX_SLASH_HERO, MIDDLE, WALL, FIRANGE,
     AROUND_HERO, ADJACENTS, EMPTY, SQRT2, ENEMIES)
-from .misc import sign, randsign, regpoly, fill_aapolygon, play
+from .misc import sign, randsign, regpoly, fill_aapolygon
 from .weapons import Bullet
 
 
@@ -36,6 +36,7 @@ class Hero:
 
     Attributes:
         surface (pygame.Surface): the display to draw on
+        rng (random.Random): generator of the hero's randomness
         x, y (int): coordinates of the center of the hero (in pixels)
         angle (float): angle of the direction the hero pointing (in radians)
         color (tuple of pygame.Color): colors of the hero on different HPs
@@ -52,8 +53,8 @@ class Hero:
         wound (float): amount of wound
         wounds (deque of float): wounds in time of an attack (ATTACK_SPEED)
     """
-    def __init__(self, surface, fps, maze_size):
-        self.surface = surface
+    def __init__(self, surface, fps, maze_size, rng):
+        self.surface, self.rng = surface, rng
         w, h = maze_size
         self.x, self.y = w >> 1, h >> 1
         self.angle, self.color = -pi * 3 / 4, TANGO['Aluminium']
@@ -93,7 +94,7 @@ class Hero:
         full_spin = pi * 2 / self.sides
         if self.slashing and self.next_strike <= 0:
             self.next_strike = ATTACK_SPEED
-            self.spin_queue = randsign() * self.spin_speed
+            self.spin_queue = randsign(self.rng) * self.spin_speed
             self.angle -= sign(self.spin_queue) * full_spin
         if round(self.spin_queue) != 0:
             self.angle += sign(self.spin_queue) * full_spin / self.spin_speed
@@ -123,12 +124,12 @@ class Hero:
         """List of Bullet the hero has just shot."""
         if not self.firing or self.slashing or self.next_strike > 0: return []
         self.next_strike = ATTACK_SPEED
-        if not randrange(int(self.highness + 1)):
+        if not self.rng.randrange(int(self.highness + 1)):
             return [Bullet(self.surface, self.x, self.y,
                            self.angle, 'Aluminium')]
         self.highness -= 1.0
         n = self.sides
-        corners = {randrange(n) for _ in range(n)}
+        corners = {self.rng.randrange(n) for _ in range(n)}
         angles = (self.angle + pi*2*corner/n for corner in corners)
         return [Bullet(self.surface, self.x, self.y, angle, 'Aluminium')
                 for angle in angles]
@@ -221,6 +222,7 @@ class Enemy:
             if self.maze.map[srcx+i//w][srcy+i//u] == WALL: return False
         self.awake = True
         self.maze.map[self.x][self.y] = ENEMY
+        self.maze.rows = None
         play(SFX_SPAWN, self.x, self.y)
         return True
 
@@ -231,7 +233,8 @@ class Enemy:
         if (self.maze.get_distance(x, y) > FIRANGE*self.maze.distance
             or self.next_strike > 0
             or (self.x, self.y) in AROUND_HERO or self.offsetx or self.offsety
-            or randrange((self.maze.hero.slashing+self.maze.isfast()+1) * 3)):
+            or self.maze.rng.randrange(
+                (self.maze.hero.slashing+self.maze.isfast()+1) * 3)):
             return False
         self.next_strike = ATTACK_SPEED
         self.maze.bullets.append(
@@ -250,9 +253,10 @@ class Enemy:
 
         self.move_speed = self.maze.fps / speed
         directions = [(sign(MIDDLE - self.x), 0), (0, sign(MIDDLE - self.y))]
-        shuffle(directions)
-        directions.append(choice(ADJACENTS))
-        if self.maze.hero.dead: directions = choice(ADJACENTS),
+        rng = self.maze.rng
+        rng.shuffle(directions)
+        directions.append(rng.choice(ADJACENTS))
+        if self.maze.hero.dead: directions = rng.choice(ADJACENTS),
         for x, y in directions:
             if (x or y) and self.maze.map[self.x + x][self.y + y] == EMPTY:
                 self.offsetx = round(x * (1 - self.move_speed))
@@ -309,7 +313,7 @@ class Enemy:
             self.spin_queue *= self.spin_speed / tmp
             self.next_strike -= 1000 / self.maze.fps
             if not self.spin_queue and not self.fire() and not self.move():
-                self.spin_queue = randsign() * self.spin_speed
+                self.spin_queue = randsign(self.maze.rng) * self.spin_speed
                 if not self.maze.hero.dead:
                     play(SFX_SLASH_HERO, self.x, self.y, self.get_slash())
             if round(self.spin_queue) != 0:
@@ -337,6 +341,7 @@ class Enemy:
     def die(self):
         """Handle the enemy's death."""
         self.maze.map[self.x][self.y] = EMPTY if self.wake else WALL
+        self.maze.rows = None
         self.alive = False
 
 
@@ -411,9 +416,11 @@ class ScarletRed(Enemy):
         if self.wound < 0: self.wound = 0.0
 
 
-def new_enemy(maze, x, y):
-    """Return an enemy of a random type in the grid (x, y)."""
-    color = choice(ENEMIES)
+def new_enemy(maze, x, y, color=None):
+    """Return an enemy of the given color, or of a random one,
+    in the grid (x, y).
+    """
+    if color is None: color = maze.rng.choice(ENEMIES)
     try:
         return getattr(modules[__name__], color)(maze, x, y)
     except AttributeError:
@@ -0,0 +1,376 @@
+# client.py - module for playing on socket servers
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for playing on socket servers'
+
+import asyncio
+from collections import namedtuple
+from socket import create_connection
+
+import numpy as np
+
+from .constants import COLOR_CODE
+
+HOST = 'localhost'
+PORT = 42069
+HEADER = 7  # length of the header and of an action
+BUFSIZE = 1 << 16
+FIELDS = 'meb'  # map, enemies and bullets
+
+# Color codes are shifted by one so that zero means nothing is there.
+LOOKUP = np.zeros(256, dtype=np.uint8)
+LOOKUP[[ord(c) for c in COLOR_CODE[:-1]]] = range(1, len(COLOR_CODE))
+
+Observation = namedtuple('Observation', ('score', 'map', 'hero',
+                                         'enemies', 'bullets', 'pixels'))
+
+
+def decode(code):
+    """Return the numeric value of the given color code."""
+    return int(LOOKUP[ord(code)])
+
+
+def encode(move, angle, attack):
+    """Return the given action as sent to the server."""
+    return '{} {} {}'.format(move, angle, attack).ljust(HEADER).encode()
+
+
+def encode_subscription(fields=FIELDS, radius=0, interval=1,
+                        pixels=None, gray=False):
+    """Return the subscription to the given fields among the map (m),
+    enemies (e) and bullets (b) within the radius around the hero
+    (in grids, 0 for the whole view), observed every interval frames,
+    as sent to the server.
+
+    If pixels is given as (width, height), the view is also drawn
+    at that resolution, in gray levels if gray is true.
+    """
+    payload = '{} {} {}'.format(fields or '-', radius, interval)
+    if pixels is not None: payload += ' {} {} {:d}'.format(*pixels, gray)
+    payload = payload.encode()
+    return 'S{:06}'.format(len(payload)).encode() + payload
+
+
+class Decoder:
+    """Decoder of observations into NumPy arrays, in the same layout
+    as the ones of brutalmaze.env.Env.
+
+    The arrays are reused from one observation to the next,
+    so they must be copied to be kept around.
+
+    Attributes:
+        map (uint8 array of shape (h, w)): visible grids
+        hero (int32 array of shape (6,)): hero's state
+        tables (dict of int32 array): capacities for enemies
+            and bullets, grown as needed
+        frame (tuple of int): shape of the pixels following the text,
+            (height, width) of gray levels or (height, width, 4)
+            of RGBX bytes, None if there is none
+    """
+    def __init__(self):
+        self.frame = None
+        self.map = np.zeros((0, 0), dtype=np.uint8)
+        self.hero = np.zeros(6, dtype=np.int32)
+        self.tables = {'enemies': np.zeros((32, 4), dtype=np.int32),
+                       'bullets': np.zeros((64, 4), dtype=np.int32)}
+
+    def table(self, key, tokens):
+        """Decode the rows of tokens into the table of the given key
+        and return the filled part.
+        """
+        codes = b''.join(tokens[0::4])
+        del tokens[0::4]
+        n, table = len(codes), self.tables[key]
+        if n > len(table):
+            table = self.tables[key] = np.zeros((n * 2, 4), dtype=np.int32)
+        if n:
+            table[:n, 0] = LOOKUP[np.frombuffer(codes, dtype=np.uint8)]
+            table[:n, 1:] = np.array(list(map(int, tokens)),
+                                     dtype=np.int32).reshape(n, 3)
+        return table[:n]
+
+    def subscribe(self, pixels=None, gray=False):
+        """Expect pixels of the given (width, height), if any,
+        in the following observations.
+        """
+        if pixels is None:
+            self.frame = None
+        else:
+            w, h = pixels
+            self.frame = (h, w) if gray else (h, w, 4)
+
+    def decode(self, data, length=None):
+        """Return the observation encoded in the first length bytes
+        of data, the whole of it by default.
+
+        Pixels are viewed in place, as (height, width) of gray levels
+        or (height, width, 3) of RGB.
+        """
+        if length is None: length = len(data)
+        pixels = None
+        if self.frame is not None:
+            size = int(np.prod(self.frame))
+            length -= size
+            pixels = np.frombuffer(data, dtype=np.uint8, count=size,
+                                   offset=length).reshape(self.frame)
+            if pixels.ndim == 3: pixels = pixels[:, :, :3]
+        end = data.find(b'\n', 0, length)
+        rows, enemies, bullets, score = map(int, data[:end].split())
+        start = end + 1
+        if rows:
+            # Rows are of equal width and decoded in place,
+            # with the newlines sliced out.
+            width = data.find(b'\n', start, length) - start
+            grid = np.frombuffer(data, dtype=np.uint8, offset=start,
+                                 count=rows * (width+1))
+            if self.map.shape != (rows, width):
+                self.map = np.empty((rows, width), dtype=np.uint8)
+            np.take(LOOKUP, grid.reshape(rows, width + 1)[:, :width],
+                    out=self.map)
+            start += rows * (width+1)
+        elif self.map.size:
+            self.map = np.zeros((0, 0), dtype=np.uint8)
+
+        tokens = data[start:length].split()
+        self.hero[0] = LOOKUP[tokens[0][0]]
+        self.hero[1:] = [int(token) for token in tokens[1:6]]
+        middle = 6 + enemies*4
+        return Observation(score, self.map, self.hero,
+                           self.table('enemies', tokens[6:middle]),
+                           self.table('bullets', tokens[middle:]), pixels)
+
+
+class Client:
+    """Connection to a socket server, reading each observation
+    into the same buffer.
+
+    Attributes:
+        sock (socket.socket): the connection
+        buffer (bytearray): buffer of the last message, grown as needed
+        decoder (Decoder): decoder of the observations
+    """
+    def __init__(self, host=HOST, port=PORT, timeout=None):
+        self.sock = create_connection((host, port), timeout)
+        self.buffer, self.decoder = bytearray(BUFSIZE), Decoder()
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc_value, traceback): self.close()
+
+    def read(self, n):
+        """Read exactly n bytes into the start of the buffer."""
+        if n > len(self.buffer): self.buffer = bytearray(n * 2)
+        received = 0
+        with memoryview(self.buffer) as view:
+            while received < n:
+                count = self.sock.recv_into(view[received:n])
+                if not count: raise ConnectionError('connection closed')
+                received += count
+
+    def recv(self):
+        """Return the next observation, or None if the game is over."""
+        self.read(HEADER)
+        length = int(self.buffer[:HEADER])
+        if not length: return None
+        self.read(length)
+        return self.decoder.decode(self.buffer, length)
+
+    def send(self, move, angle, attack):
+        """Send the action, in the same form as the server's input."""
+        self.sock.sendall(encode(move, angle, attack))
+
+    def subscribe(self, fields=FIELDS, radius=0, interval=1,
+                  pixels=None, gray=False):
+        """Subscribe to a subset of the observations in place of
+        the next action and return the next observation.
+
+        See encode_subscription for the meaning of the arguments.
+        """
+        self.sock.sendall(encode_subscription(fields, radius, interval,
+                                              pixels, gray))
+        self.decoder.subscribe(pixels, gray)
+        return self.recv()
+
+    def play(self, policy, subscription=None):
+        """Play until the game is over, sending the action returned
+        by policy for each observation, and return the last score.
+
+        If given, the subscription is a tuple of the arguments
+        to subscribe with after the first observation.
+        """
+        score, obs = None, self.recv()
+        if subscription is not None and obs is not None:
+            obs = self.subscribe(*subscription)
+        while obs is not None:
+            score = obs.score
+            self.send(*policy(obs))
+            obs = self.recv()
+        return score
+
+    def close(self):
+        """Close the connection."""
+        self.sock.close()
+
+
+class AsyncClient(asyncio.Protocol):
+    """Connection to a socket server for use with asyncio,
+    created by AsyncClient.connect, receiving into the same buffer.
+
+    Attributes:
+        transport (asyncio.Transport): the connection
+        buffer (bytearray): received data, starting with the last
+            message, grown as needed
+        size (int): number of bytes received in the buffer
+        consumed (int): number of bytes of the last message
+        decoder (Decoder): decoder of the observations
+    """
+    def __init__(self):
+        self.transport, self.decoder = None, Decoder()
+        self.buffer, self.size, self.consumed = bytearray(BUFSIZE), 0, 0
+        self.waiter, self.closed = None, False
+
+    @classmethod
+    async def connect(cls, host=HOST, port=PORT):
+        """Return a client connected to the given server."""
+        loop = asyncio.get_event_loop()
+        transport, client = await loop.create_connection(cls, host, port)
+        return client
+
+    async def __aenter__(self): return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback): self.close()
+
+    def connection_made(self, transport): self.transport = transport
+
+    def data_received(self, data):
+        end = self.size + len(data)
+        if end > len(self.buffer):
+            # Observations still view the old buffer, which thus
+            # cannot be resized.
+            buffer = bytearray(end * 2)
+            buffer[:self.size] = memoryview(self.buffer)[:self.size]
+            self.buffer = buffer
+        self.buffer[self.size:end] = data
+        self.size = end
+        self.wake()
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.wake()
+
+    def wake(self):
+        """Resume the pending read, if any."""
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def read(self, n):
+        """Wait until the first n bytes of the buffer are received."""
+        while self.size < n:
+            if self.closed: raise ConnectionError('connection closed')
+            self.waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+
+    def consume(self, n):
+        """Move the bytes received after the first n to the start."""
+        self.size -= n
+        if self.size:
+            with memoryview(self.buffer) as view:
+                view[:self.size] = view[n:n+self.size]
+
+    async def recv(self):
+        """Return the next observation, or None if the game is over."""
+        self.consume(self.consumed)
+        await self.read(HEADER)
+        length = int(self.buffer[:HEADER])
+        self.consume(HEADER)
+        self.consumed = length
+        if not length: return None
+        await self.read(length)
+        return self.decoder.decode(self.buffer, length)
+
+    async def send(self, move, angle, attack):
+        """Send the action, in the same form as the server's input."""
+        self.transport.write(encode(move, angle, attack))
+
+    async def subscribe(self, fields=FIELDS, radius=0, interval=1,
+                        pixels=None, gray=False):
+        """Subscribe to a subset of the observations in place of
+        the next action and return the next observation.
+
+        See encode_subscription for the meaning of the arguments.
+        """
+        self.transport.write(encode_subscription(fields, radius, interval,
+                                                 pixels, gray))
+        self.decoder.subscribe(pixels, gray)
+        return await self.recv()
+
+    async def play(self, policy, subscription=None):
+        """Play until the game is over, sending the action returned
+        by policy for each observation, and return the last score.
+
+        If given, the subscription is a tuple of the arguments
+        to subscribe with after the first observation.
+        """
+        score, obs = None, await self.recv()
+        if subscription is not None and obs is not None:
+            obs = await self.subscribe(*subscription)
+        while obs is not None:
+            score = obs.score
+            await self.send(*policy(obs))
+            obs = await self.recv()
+        return score
+
+    def close(self):
+        """Close the connection."""
+        self.transport.close()
+
+
+def play(policy, host=HOST, port=PORT, timeout=None, subscription=None):
+    """Play a game on the given server and return the last score."""
+    with Client(host, port, timeout) as client:
+        return client.play(policy, subscription)
+
+
+async def play_async(policy, host=HOST, port=PORT, subscription=None):
+    """Play a game on the given server and return the last score."""
+    async with await AsyncClient.connect(host, port) as client:
+        return await client.play(policy, subscription)
+
+
+async def play_all(policy, addresses, subscription=None):
+    """Play a game on each of the given (host, port) concurrently
+    and return the last scores.
+    """
+    return await asyncio.gather(*(
+        play_async(policy, host, port, subscription)
+        for host, port in addresses))
+
+
+def play_many(policy, addresses, subscription=None):
+    """Play a game on each of the given (host, port) concurrently
+    from this thread and return the last scores.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(play_all(policy, addresses,
+                                                subscription))
+    finally:
+        loop.close()
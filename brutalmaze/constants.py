@@ -20,21 +20,33 @@ __doc__ = 'Brutal Maze module for shared constants'
 
 from string import ascii_lowercase
 
-import pygame
-from pkg_resources import resource_filename as pkg_file
 
-SETTINGS = pkg_file('brutalmaze', 'settings.ini')
-ICON = pygame.image.load(pkg_file('brutalmaze', 'icon.png'))
+def pkg_file(name):
+    """Return path to the given resource of Brutal Maze.
 
-SFX_NOISE = pkg_file('brutalmaze', 'soundfx/noise.ogg')
-SFX_SPAWN = pkg_file('brutalmaze', 'soundfx/spawn.ogg')
-SFX_SLASH_ENEMY = pkg_file('brutalmaze', 'soundfx/slash-enemy.ogg')
-SFX_SLASH_HERO = pkg_file('brutalmaze', 'soundfx/slash-hero.ogg')
-SFX_SHOT_ENEMY = pkg_file('brutalmaze', 'soundfx/shot-enemy.ogg')
-SFX_SHOT_HERO = pkg_file('brutalmaze', 'soundfx/shot-hero.ogg')
-SFX_MISSED = pkg_file('brutalmaze', 'soundfx/missed.ogg')
-SFX_HEART = pkg_file('brutalmaze', 'soundfx/heart.ogg')
-SFX_LOSE = pkg_file('brutalmaze', 'soundfx/lose.ogg')
+    importlib.resources is only imported on demand since it is
+    rather heavy compared to the rest of the headless simulation.
+    """
+    try:
+        from importlib.resources import files
+    except ImportError:     # Python < 3.9
+        from importlib_resources import files
+    return str(files(__package__).joinpath(name))
+
+
+# Resources are named relatively to the package and resolved by pkg_file.
+SETTINGS = 'settings.ini'
+ICON = 'icon.png'
+
+SFX_NOISE = 'soundfx/noise.ogg'
+SFX_SPAWN = 'soundfx/spawn.ogg'
+SFX_SLASH_ENEMY = 'soundfx/slash-enemy.ogg'
+SFX_SLASH_HERO = 'soundfx/slash-hero.ogg'
+SFX_SHOT_ENEMY = 'soundfx/shot-enemy.ogg'
+SFX_SHOT_HERO = 'soundfx/shot-hero.ogg'
+SFX_MISSED = 'soundfx/missed.ogg'
+SFX_HEART = 'soundfx/heart.ogg'
+SFX_LOSE = 'soundfx/lose.ogg'
 SFX = (SFX_NOISE, SFX_SPAWN, SFX_SLASH_ENEMY, SFX_SLASH_HERO,
        SFX_SHOT_ENEMY, SFX_SHOT_HERO, SFX_MISSED, SFX_HEART, SFX_LOSE)
 
@@ -48,6 +60,7 @@ MAZE_SIZE = 10  # cells
 MIDDLE = MAZE_SIZE // 2 * CELL_WIDTH
 HEAL_SPEED = 1  # HP/s
 HERO_SPEED = 5  # grid/s
+ANGLE_DIGITS = 3    # decimals of controlled angles in radians
 ENEMY_SPEED = 6     # grid/s
 BULLET_SPEED = 15   # grid/s
 ATTACK_SPEED = 333.333  # ms/strike
@@ -0,0 +1,158 @@
+# dataset.py - module for exporting records to NumPy datasets
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for exporting records to NumPy datasets'
+
+import json
+from argparse import ArgumentParser
+from os import makedirs, path
+
+import numpy as np
+
+from .env import observe
+from .records import read
+from .stats import find
+
+INDEX = 'index.json'
+CHUNK_SIZE = 1024   # snapshots
+MAP_SHAPE = 19, 25  # rows and columns shown on a 640x480 display
+
+
+def fields(shape, max_enemies, max_bullets):
+    """Return the dtype and the shape of one snapshot of each array."""
+    return {'map': ('uint8', shape), 'hero': ('int32', (6,)),
+            'enemies': ('int32', (max_enemies, 4)),
+            'bullets': ('int32', (max_bullets, 4)),
+            'score': ('int32', ()), 'time': ('int32', ())}
+
+
+def export(filenames, directory, shape=MAP_SHAPE,
+           max_enemies=32, max_bullets=64, chunk_size=CHUNK_SIZE):
+    """Stream snapshots of the given records into raw arrays
+    inside the directory and write their index.
+
+    Snapshots are decoded the same way as Env's observations,
+    with maps centered at the hero and cropped or padded to shape.
+    Only chunk_size snapshots are kept in memory at once.
+    Return the number of exported snapshots.
+    """
+    makedirs(directory, exist_ok=True)
+    specs = fields(tuple(shape), max_enemies, max_bullets)
+    chunk = {key: np.zeros((chunk_size, *dims), dtype=dtype)
+             for key, (dtype, dims) in specs.items()}
+    files = {key: open(path.join(directory, key + '.bin'), 'wb')
+             for key in specs}
+    records, count, i = [], 0, 0
+    try:
+        for filename in filenames:
+            start, time = count, 0
+            for snapshot in read(filename):
+                time += snapshot.get('t', 0)
+                observe(snapshot, chunk, i)
+                chunk['score'][i], chunk['time'][i] = snapshot['s'], time
+                count, i = count + 1, i + 1
+                if i < chunk_size: continue
+                for key, array in chunk.items(): array.tofile(files[key])
+                i = 0
+            records.append([path.abspath(filename), start, count])
+        for key, array in chunk.items(): array[:i].tofile(files[key])
+    finally:
+        for file in files.values(): file.close()
+
+    with open(path.join(directory, INDEX), 'w') as f:
+        json.dump({'length': count, 'records': records,
+                   'fields': {key: [dtype, list(dims)]
+                              for key, (dtype, dims) in specs.items()}}, f)
+    return count
+
+
+class Dataset:
+    """Dataset exported by export, memory-mapped for random access
+    without loading it into RAM.
+
+    Attributes:
+        directory (str): directory containing the dataset
+        length (int): number of snapshots
+        arrays (dict of numpy.memmap): read-only arrays by field
+        records (list of tuple): path to each record, and indices
+            of its first and after its last snapshot
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(path.join(directory, INDEX)) as f: index = json.load(f)
+        self.length = index['length']
+        self.records = [tuple(record) for record in index['records']]
+        self.arrays = {}
+        for key, (dtype, dims) in index['fields'].items():
+            # Empty files cannot be memory-mapped.
+            if not self.length:
+                self.arrays[key] = np.zeros((0, *dims), dtype=dtype)
+                continue
+            self.arrays[key] = np.memmap(
+                path.join(directory, key + '.bin'), dtype=dtype, mode='r',
+                shape=(self.length, *dims))
+
+    def __len__(self): return self.length
+
+    def __getitem__(self, index):
+        """Return the snapshots at the given index, slice or array
+        of indices as a dictionary of arrays.
+        """
+        return {key: array[index] for key, array in self.arrays.items()}
+
+    def record(self, i):
+        """Return all snapshots of the i-th record."""
+        filename, start, stop = self.records[i]
+        return self[start:stop]
+
+    def batches(self, size, rng=None):
+        """Yield minibatches of the given size in random order,
+        drawn using the given NumPy random generator.
+        """
+        if rng is None: rng = np.random.default_rng()
+        order = rng.permutation(self.length)
+        for start in range(0, self.length, size):
+            # Sorted indices read the memory-mapped files sequentially.
+            yield self[np.sort(order[start:start+size])]
+
+
+def main():
+    """Export records to a memory-mappable NumPy dataset."""
+    parser = ArgumentParser(description='export Brutal Maze records to raw'
+                            ' NumPy arrays to be memory-mapped for training')
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='records or directories of records')
+    parser.add_argument('-o', '--output-dir', required=True, metavar='DIR',
+                        help='directory to write the dataset to')
+    parser.add_argument(
+        '-s', '--shape', type=int, nargs=2, default=MAP_SHAPE,
+        metavar=('ROWS', 'COLUMNS'),
+        help='shape of map planes (fallback: {}x{})'.format(*MAP_SHAPE))
+    parser.add_argument('-e', '--max-enemies', type=int, default=32,
+                        metavar='N',
+                        help='enemies per snapshot (fallback: 32)')
+    parser.add_argument('-b', '--max-bullets', type=int, default=64,
+                        metavar='N',
+                        help='bullets per snapshot (fallback: 64)')
+    args = parser.parse_args()
+    count = export(sorted(find(args.paths)), args.output_dir, args.shape,
+                   args.max_enemies, args.max_bullets)
+    print('exported', count, 'snapshots to', args.output_dir)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,205 @@
+# env.py - module for batched in-process environments
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for batched in-process environments'
+
+from math import radians
+from multiprocessing import Pipe, Process
+
+import numpy as np
+
+from .client import LOOKUP, decode
+from .maze import Maze
+
+
+def paste(rows, plane):
+    """Decode the rows of a map onto the plane, both centered
+    at the hero, cropping or padding the map to fit.
+    """
+    grid = LOOKUP[np.frombuffer(''.join(rows).encode(), dtype=np.uint8)]
+    grid = grid.reshape(len(rows), -1)
+    (h, w), (m, n) = plane.shape, grid.shape
+    y, x = (m - h) // 2, (n - w) // 2
+    h, w = min(h, m), min(w, n)
+    plane[max(-y, 0):max(-y, 0)+h, max(-x, 0):max(-x, 0)+w] = grid[
+        max(y, 0):max(y, 0)+h, max(x, 0):max(x, 0)+w]
+
+
+def observe(export, obs, i):
+    """Write the given export of a maze to the i-th observation
+    of the batch obs.
+    """
+    rows = export.get('m')
+    obs['map'][i] = 0
+    if rows: paste(rows, obs['map'][i])
+
+    hero = export['h']
+    obs['hero'][i] = decode(hero[0]), *hero[1:]
+    for key, field in ('enemies', 'e'), ('bullets', 'b'):
+        table = obs[key][i]
+        table[:] = 0
+        for j, (color, x, y, angle) in enumerate(export.get(field, ())):
+            if j >= len(table): break
+            table[j] = decode(color), x, y, angle
+
+
+class Env:
+    """Batch of headless mazes played in lockstep.
+
+    Actions are given in the same form as the socket server's input,
+    i.e. one row of (move, angle, attack) per maze, and observations
+    are returned as a dictionary of NumPy arrays:
+
+        map (uint8 array of shape (n, h, w)): visible grids
+        hero (int32 array of shape (n, 6)): hero's state
+        enemies (int32 array of shape (n, max_enemies, 4)): enemies
+        bullets (int32 array of shape (n, max_bullets, 4)): bullets
+
+    Color codes are decoded to integers from 1 to 26, while 0 means
+    empty grids or padding.  Finished episodes are reset automatically
+    and the observation returned for them is the first one of the new
+    episode.
+
+    Attributes:
+        n (int): number of mazes
+        size (tuple of int): size of each maze (in px)
+        fps (float): simulated frame rate
+        max_enemies, max_bullets (int): capacities of the padded tables
+        seed (int): seed of the first maze, the i-th one is seeded
+            by seed + i, None for random seeds
+        mazes (list of Maze): mazes played in this process
+        scores (list of int): scores at the last step
+        workers (list of tuple): connection, process and number of mazes
+            of each worker
+    """
+    def __init__(self, n, size=(640, 480), fps=30.0,
+                 max_enemies=32, max_bullets=64, processes=0, seed=None):
+        self.n, self.size, self.fps = n, size, fps
+        self.max_enemies, self.max_bullets = max_enemies, max_bullets
+        self.seed = seed
+        self.mazes, self.scores, self.workers = [], [], []
+        if not processes:
+            for i in range(n):
+                self.mazes.append(Maze(fps, size, True, '', 1000 / fps,
+                                       seed=None if seed is None else seed+i))
+                self.scores.append(0)
+            return
+        start = seed
+        for k in range(processes):
+            count = n//processes + (k < n % processes)
+            if not count: continue
+            parent, child = Pipe()
+            process = Process(target=work, daemon=True, args=(
+                child, count, size, fps, max_enemies, max_bullets, start))
+            process.start()
+            child.close()
+            self.workers.append((parent, process, count))
+            if start is not None: start += count
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc_value, traceback): self.close()
+
+    def empty(self):
+        """Return a batch of zeroed observations."""
+        maze = self.mazes[0]
+        shape = len(maze.rangey), len(maze.rangex)
+        return {'map': np.zeros((self.n, *shape), dtype=np.uint8),
+                'hero': np.zeros((self.n, 6), dtype=np.int32),
+                'enemies': np.zeros((self.n, self.max_enemies, 4),
+                                    dtype=np.int32),
+                'bullets': np.zeros((self.n, self.max_bullets, 4),
+                                    dtype=np.int32)}
+
+    def gather(self, command, actions=None):
+        """Send the command to every worker along with its share
+        of actions and return the concatenated results.
+        """
+        start = 0
+        for connection, process, count in self.workers:
+            if actions is None:
+                connection.send((command, None))
+            else:
+                connection.send((command, actions[start:start+count]))
+            start += count
+        results = [connection.recv() for connection, p, c in self.workers]
+        obs = {key: np.concatenate([result[0][key] for result in results])
+               for key in results[0][0]}
+        return (obs, *(np.concatenate(parts)
+                       for parts in tuple(zip(*results))[1:]))
+
+    def reset(self):
+        """Start new games in all mazes and return the observations."""
+        if self.workers: return self.gather('reset')[0]
+        obs = self.empty()
+        for i, maze in enumerate(self.mazes):
+            maze.reinit()
+            self.scores[i] = maze.get_score()
+            observe(maze.update_export(forced=True), obs, i)
+        return obs
+
+    def step(self, actions):
+        """Apply the given actions, advance every maze by one frame
+        and return the observations, rewards and done flags.
+
+        Rewards are the differences in score since the last step.
+        """
+        actions = np.asarray(actions, dtype=np.int64).reshape(self.n, 3)
+        if self.workers: return self.gather('step', actions)
+
+        obs = self.empty()
+        rewards = np.zeros(self.n, dtype=np.int32)
+        dones = np.zeros(self.n, dtype=bool)
+        for i, maze in enumerate(self.mazes):
+            move, angle, attack = (int(a) for a in actions[i])
+            y, x = (j - 1 for j in divmod(move, 3))
+            maze.control(x, y, radians(angle), attack & 1, attack >> 1)
+            maze.update(self.fps)
+            score = maze.get_score()
+            rewards[i], self.scores[i] = score - self.scores[i], score
+            if maze.hero.dead:
+                dones[i] = True
+                maze.reinit()
+                self.scores[i] = maze.get_score()
+            observe(maze.update_export(forced=True), obs, i)
+        return obs, rewards, dones
+
+    def close(self):
+        """Stop all worker processes."""
+        for connection, process, count in self.workers:
+            connection.send(('close', None))
+            process.join()
+            connection.close()
+        self.workers = []
+
+
+def work(connection, n, size, fps, max_enemies, max_bullets, seed):
+    """Serve commands from the parent Env through the given connection.
+
+    This function is supposed to be run in a worker process.
+    """
+    env = Env(n, size, fps, max_enemies, max_bullets, seed=seed)
+    while True:
+        command, actions = connection.recv()
+        if command == 'reset':
+            connection.send((env.reset(),))
+        elif command == 'step':
+            connection.send(env.step(actions))
+        else:
+            break
+    connection.close()
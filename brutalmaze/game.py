@@ -16,8 +16,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
 
-__version__ = '0.9.2'
-
 import re
 from argparse import ArgumentParser, FileType, RawTextHelpFormatter
 from configparser import ConfigParser
@@ -25,19 +23,29 @@ from contextlib import redirect_stdout
 from io import StringIO
 from math import atan2, radians, pi
 from os.path import join as pathjoin, pathsep
-from socket import socket, SOL_SOCKET, SO_REUSEADDR
-from sys import stdout
-from threading import Thread
+from socket import (socket, timeout, IPPROTO_TCP, SOL_SOCKET, SO_REUSEADDR,
+                    TCP_NODELAY)
+from sys import byteorder, stdout
+from threading import Event, Thread
+from time import perf_counter
 
 with redirect_stdout(StringIO()): import pygame
 from pygame import KEYDOWN, MOUSEBUTTONUP, QUIT, VIDEORESIZE
 from pygame.time import Clock, get_ticks
-from palace import free, use_context, Device, Context
 from appdirs import AppDirs
 
-from .constants import SETTINGS, ICON, SFX, SFX_NOISE, HERO_SPEED, MIDDLE
+from . import __version__
+from .audio import use_mixer, Mixer, NullMixer
+from .constants import SETTINGS, ICON, SFX_NOISE, MIDDLE, pkg_file
 from .maze import Maze
-from .misc import sign, deg, join, play
+from .metrics import Metrics, serve
+from .profiler import NullProfiler, Profiler
+from .records import WRITERS
+from .replay import draw, replay
+from .misc import deg
+
+
+MAX_PIXELS = 1 << 20   # per pixel observation
 
 
 class ConfigReader:
@@ -46,6 +54,7 @@ class ConfigReader:
     """
     CONTROL_ALIASES = (('New game', 'new'), ('Toggle pause', 'pause'),
                        ('Toggle mute', 'mute'),
+                       ('Toggle profiler', 'profile'),
                        ('Move left', 'left'), ('Move right', 'right'),
                        ('Move up', 'up'), ('Move down', 'down'),
                        ('Long-range attack', 'shot'),
@@ -55,7 +64,7 @@ class ConfigReader:
 
     def __init__(self, filenames):
         self.config = ConfigParser()
-        self.config.read(SETTINGS)  # default configuration
+        self.config.read(pkg_file(SETTINGS))  # default configuration
         self.config.read(filenames)
 
     # Fallback to None when attribute is missing
@@ -71,11 +80,14 @@ class ConfigReader:
         self.touch = self.config.getboolean('Control', 'Touch')
         self.export_dir = self.config.get('Record', 'Directory')
         self.export_rate = self.config.getint('Record', 'Frequency')
+        self.export_format = self.config.get('Record', 'Format')
         self.server = self.config.getboolean('Server', 'Enable')
         self.host = self.config.get('Server', 'Host')
         self.port = self.config.getint('Server', 'Port')
         self.timeout = self.config.getfloat('Server', 'Timeout')
         self.headless = self.config.getboolean('Server', 'Headless')
+        self.metrics = self.config.get('Server', 'Metrics')
+        self.pool = self.config.getint('Server', 'Pool')
 
         if self.server: return
         self.key, self.mouse = {}, {}
@@ -96,20 +108,89 @@ class ConfigReader:
 
     def read_args(self, arguments):
         """Read and parse a ArgumentParser.Namespace."""
-        for option in ('size', 'max_fps', 'muted', 'musicvol',
-                       'touch', 'export_dir', 'export_rate', 'server',
-                       'host', 'port', 'timeout', 'headless'):
+        for option in ('size', 'max_fps', 'muted', 'musicvol', 'touch',
+                       'export_dir', 'export_rate', 'export_format', 'seed',
+                       'trace', 'server', 'host', 'port', 'timeout',
+                       'headless', 'metrics', 'pool'):
             value = getattr(arguments, option)
             if value is not None: setattr(self, option, value)
 
 
+class Screen:
+    """Offscreen surface drawn on for pixel observations,
+    reused from frame to frame.
+
+    Pixels are either gray levels, by drawing on a surface whose
+    palette is the grayscale, or RGBX bytes.
+
+    Attributes:
+        surface (pygame.Surface): the surface drawn on
+        view (pygame.BufferProxy): view of the pixels, None if the rows
+            are padded, which happens to gray surfaces whose width
+            is not a multiple of four
+        nbytes (int): size of the pixels without padding (in bytes)
+        grid (tuple of int): number of columns and rows last drawn
+    """
+    def __init__(self, size, gray=False):
+        if gray:
+            self.surface = pygame.Surface(size, depth=8)
+            self.surface.set_palette([(i, i, i) for i in range(256)])
+        else:
+            masks = (0xff, 0xff00, 0xff0000, 0)
+            if byteorder == 'big': masks = (0xff000000, 0xff0000, 0xff00, 0)
+            self.surface = pygame.Surface(size, 0, 32, masks)
+        w, h = size
+        self.nbytes = w * h * self.surface.get_bytesize()
+        contiguous = self.surface.get_pitch() == self.nbytes // h
+        self.view = self.surface.get_view('0') if contiguous else None
+        self.grid = 1, 1
+
+    def draw(self, export):
+        """Draw the export the way records are replayed."""
+        self.grid = draw(self.surface, export, self.grid)
+
+    def pixels(self):
+        """Return the pixels row by row, without copying if possible."""
+        if self.view is not None: return self.view
+        return pygame.image.tostring(self.surface, 'P')
+
+
+def recv_exactly(connection, n):
+    """Return n bytes received from the connection,
+    or fewer if it is closed before.
+    """
+    buffer, received = bytearray(n), 0
+    with memoryview(buffer) as view:
+        while received < n:
+            count = connection.recv_into(view[received:])
+            if not count: break
+            received += count
+    return buffer[:received]
+
+
+def send_parts(connection, parts):
+    """Send the parts one after another, without joining them
+    where scatter-gather sending is available.
+    """
+    if not hasattr(connection, 'sendmsg'):  # e.g. on Windows
+        connection.sendall(b''.join(parts))
+        return
+    views = [memoryview(part).cast('B') for part in parts]
+    while views:
+        sent = connection.sendmsg(views)
+        while views and sent >= views[0].nbytes:
+            sent -= views.pop(0).nbytes
+        if views: views[0] = views[0][sent:]
+
+
 class Game:
     """Object handling main loop and IO."""
     def __init__(self, config: ConfigReader):
-        pygame.init()
         self.headless = config.headless and config.server
-        if not self.headless: pygame.display.set_icon(ICON)
-        self.actx = None if self.headless else Context(Device())
+        if not self.headless:
+            pygame.init()
+            pygame.display.set_icon(pygame.image.load(pkg_file(ICON)))
+        self.mixer = NullMixer()
         self._mute = config.muted
 
         if config.server:
@@ -124,34 +205,45 @@ class Game:
         else:
             self.server = self.sockinp = None
 
+        self.metrics = Metrics()
+        self.metrics.target.set(config.max_fps)
+        if config.metrics:
+            self.metrics_server = serve(self.metrics, config.metrics)
+            print('Metrics are served on', config.metrics)
+        else:
+            self.metrics_server = None
+
         self.max_fps, self.fps = config.max_fps, config.max_fps
         self.musicvol = config.musicvol
         self.touch = config.touch
         self.key, self.mouse = config.key, config.mouse
         self.maze = Maze(config.max_fps, config.size, config.headless,
-                         config.export_dir, 1000 / config.export_rate)
+                         config.export_dir, 1000 / config.export_rate,
+                         config.export_format, config.seed, config.pool)
         self.hero = self.maze.hero
         self.clock, self.paused = Clock(), False
+        self.session = Event()
+        self.trace = config.trace
+        self.use_profiler(NullProfiler() if self.trace is None else Profiler())
 
     def __enter__(self):
-        if self.actx is not None:
-            use_context(self.actx)
-            self.actx.listener.position = MIDDLE, -MIDDLE, 0
-            self.actx.listener.gain = not self._mute
-            self._source = play(SFX_NOISE)
-            self._source.looping = True
+        if not self.headless:
+            self.mixer = Mixer()
+            self.mixer.gain = not self._mute
+            self.mixer.loop(SFX_NOISE)
+            use_mixer(self.mixer)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.server is not None: self.server.close()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
         if not self.hero.dead: self.maze.dump_records()
-        if self.actx is not None:
-            free(SFX)
-            self._source.stop()
-            self.actx.update()
-            use_context(None)
-            self.actx.destroy()
-            self.actx.device.close()
+        self.maze.close()
+        if self.trace is not None: self.profiler.dump(self.trace)
+        use_mixer(NullMixer())
+        self.mixer.destroy()
         pygame.quit()
 
     @property
@@ -163,22 +255,66 @@ class Game:
     def mute(self, value):
         """Mute state."""
         self._mute = int(bool(value))
-        self.actx.listener.gain = not self._mute
+        self.mixer.gain = not self._mute
+
+    def use_profiler(self, profiler):
+        """Time the phases of frames with the given profiler."""
+        self.profiler = self.maze.profiler = profiler
 
-    def export_txt(self):
-        """Export maze data to string."""
-        export = self.maze.update_export(forced=True)
-        return '{} {} {} {}\n{}{}{}{}'.format(
-            len(export['m']), len(export['e']), len(export['b']), export['s'],
-            ''.join(row + '\n' for row in export['m']), join(export['h']),
-            ''.join(map(join, export['e'])), ''.join(map(join, export['b'])))
+    def export_txt(self, fields='meb', radius=0, export=None):
+        """Export maze data to string.
+
+        Only the hero and the given fields among the map (m),
+        enemies (e) and bullets (b) are exported.  If radius is
+        positive, the view is cropped to the grids within that radius
+        around the hero, with positions relative to the cropped map.
+        If given, the export, already cropped, is used instead of
+        a new one.
+        """
+        if export is None:
+            export = self.maze.update_export(forced=True, fields=fields)
+            if radius: export = self.crop(export, radius)
+        rows, enemies, bullets = (export[key] if key in fields else ()
+                                  for key in 'meb')
+        # Lines are gathered in one list and joined only once.
+        lines = ['{} {} {} {}'.format(len(rows), len(enemies), len(bullets),
+                                      export['s'])]
+        lines.extend(rows)
+        lines.append('{} {} {} {} {} {}'.format(*export['h']))
+        lines.extend(['{} {} {} {}'.format(*e) for e in enemies])
+        lines.extend(['{} {} {} {}'.format(*b) for b in bullets])
+        lines.append('')
+        return '\n'.join(lines)
+
+    def crop(self, export, radius):
+        """Return the export cropped to the grids within the radius
+        around the hero, with positions relative to the cropped map.
+        """
+        w, h = len(self.maze.rangex), len(self.maze.rangey)
+        left, top = max(w//2 - radius, 0), max(h//2 - radius, 0)
+        right, bottom = min(w//2 + radius + 1, w), min(h//2 + radius + 1, h)
+        rows = [row[left:right] for row in export['m'][top:bottom]]
+        left, top, right, bottom = left*100, top*100, right*100, bottom*100
+        hero = export['h']
+        enemies, bullets = ([[c, x - left, y - top, a]
+                             for c, x, y, a in export[key]
+                             if left <= x < right and top <= y < bottom]
+                            for key in 'eb')
+        return {'s': export['s'], 'm': rows,
+                'h': [hero[0], hero[1] - left, hero[2] - top, *hero[3:]],
+                'e': enemies, 'b': bullets}
 
     def update(self):
         """Draw and handle meta events on Pygame window.
 
         Return False if QUIT event is captured, True otherwise.
         """
-        events = pygame.event.get()
+        if self.headless and not self.session.is_set():
+            # Nobody is playing, so block instead of ticking the game.
+            self.session.wait()
+            self.clock.tick()
+        self.profiler.lap('control')
+        events = [] if self.headless else pygame.event.get()
         for event in events:
             if event.type == QUIT:
                 return False
@@ -192,6 +328,10 @@ class Game:
                         self.maze.reinit()
                     elif event.key == self.key['pause'] and not self.hero.dead:
                         self.paused ^= True
+                    elif event.key == self.key['profile']:
+                        if isinstance(self.profiler, NullProfiler):
+                            self.use_profiler(Profiler())
+                        self.profiler.overlay ^= True
             elif event.type == MOUSEBUTTONUP and self.touch:
                 # We're careless about which mouse button is clicked.
                 maze = self.maze
@@ -212,74 +352,98 @@ class Game:
             self.fps -= 1
         elif self.fps < self.max_fps and not self.paused:
             self.fps += 5
-        if not self.paused: self.maze.update(self.fps)
+        self.profiler.lap('events')
+        self.metrics.fps.set(new_fps)
+        self.metrics.limit.set(self.fps)
+        if not self.paused:
+            start = perf_counter()
+            self.maze.update(self.fps)
+            self.metrics.tick.observe(perf_counter() - start)
+            self.metrics.ticks.inc()
         if not self.headless: self.maze.draw()
+        self.profiler.lap('draw')
         self.clock.tick(self.fps)
-        self.actx.update()
+        self.profiler.lap('idle')
+        self.mixer.update()
+        self.profiler.lap('audio')
         return True
 
-    def move(self, x=0, y=0):
-        """Command the hero to move faster in the given direction."""
-        maze = self.maze
-        velocity = maze.distance * HERO_SPEED / self.fps
-        accel = velocity * HERO_SPEED / self.fps
-
-        if x == y == 0:
-            maze.set_step()
-            x, y = maze.stepx, maze.stepy
-        else:
-            x, y = -x, -y   # or move the maze in the reverse direction
-
-        if maze.next_move > 0 or not x:
-            maze.vx -= sign(maze.vx) * accel
-            if abs(maze.vx) < accel * 2: maze.vx = 0.0
-        elif x * maze.vx < 0:
-            maze.vx += x * 2 * accel
-        else:
-            maze.vx += x * accel
-            if abs(maze.vx) > velocity: maze.vx = x * velocity
-
-        if maze.next_move > 0 or not y:
-            maze.vy -= sign(maze.vy) * accel
-            if abs(maze.vy) < accel * 2: maze.vy = 0.0
-        elif y * maze.vy < 0:
-            maze.vy += y * 2 * accel
-        else:
-            maze.vy += y * accel
-            if abs(maze.vy) > velocity: maze.vy = y * velocity
-
     def control(self, x, y, angle, firing, slashing):
         """Control how the hero move and attack."""
-        self.move(x, y)
-        self.hero.update_angle(angle)
-        self.hero.firing = firing
-        self.hero.slashing = slashing
+        self.maze.control(x, y, angle, firing, slashing)
 
     def remote_control(self):
         """Handle remote control though socket server.
 
         This function is supposed to be run in a Thread.
         """
-        clock = Clock()
+        clock, metrics = Clock(), self.metrics
         while True:
             connection, address = self.server.accept()
             connection.settimeout(self.timeout)
-            time = get_ticks()
-            print('[{}] Connected to {}:{}'.format(time, *address))
+            connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            time, start = get_ticks(), perf_counter()
+            metrics.sessions.inc()
+            metrics.active.set(1)
             self.maze.reinit()
+            self.session.set()
+            first, fields, radius, interval = True, 'meb', 0, 1
+            screen = None
             while True:
                 if self.hero.dead:
                     connection.send('0000000'.encode())
                     break
-                data = self.export_txt().encode()
+                # The same export is serialized and drawn,
+                # so drawing needs every field.
+                export = self.maze.update_export(
+                    forced=True, fields=fields if screen is None else 'meb')
+                if radius: export = self.crop(export, radius)
+                data = self.export_txt(fields, radius, export).encode()
                 alpha = deg(self.hero.angle)
-                connection.send('{:07}'.format(len(data)).encode())
-                connection.send(data)
+                if screen is None:
+                    length, parts = len(data), [data]
+                else:
+                    # Pixels follow the text within the same message.
+                    screen.draw(export)
+                    length = len(data) + screen.nbytes
+                    parts = [data, screen.pixels()]
+                # Each message is sent at once, so that it is not held
+                # back waiting for the acknowledgement of its header.
+                send_parts(connection,
+                           ['{:07}'.format(length).encode(), *parts])
+                if first:
+                    latency, first = perf_counter() - start, False
+                    metrics.first.observe(latency)
+                    print('[{}] Connected to {}:{}, first observation'
+                          ' sent in {:.2f}ms'.format(time, *address,
+                                                     latency * 1000))
+                metrics.observations.inc()
+                metrics.size.observe(length)
                 try:
                     buf = connection.recv(7)
-                except:     # client is closed or timed out
+                except timeout:
+                    metrics.timeouts.inc()
+                    break
+                except:     # client is closed
                     break
                 if not buf: break
+                if buf.startswith(b'S'):
+                    # Subscription in place of an action, answered
+                    # by the next observation right away.
+                    try:
+                        size = int(buf[1:])
+                        payload = recv_exactly(connection, size)
+                        if len(payload) < size: break   # closed midway
+                        fields, radius, interval, *pixels = (
+                            payload.decode().split())
+                        radius, interval = int(radius), int(interval)
+                        w, h, gray = map(int, pixels) if pixels else (0,)*3
+                    except (ValueError, OSError):    # invalid input
+                        break
+                    if min(radius, w, h) < 0 or interval < 1: break
+                    if w * h > MAX_PIXELS: break
+                    screen = Screen((w, h), gray) if w and h else None
+                    continue
                 try:
                     move, angle, attack = map(int, buf.decode().split())
                 except ValueError:  # invalid input
@@ -288,28 +452,32 @@ class Game:
                 # Time is the essence.
                 angle = self.hero.angle if angle == alpha else radians(angle)
                 self.sockinp = x, y, angle, attack & 1, attack >> 1
-                clock.tick(self.fps)
+                for _ in range(interval): clock.tick(self.fps)
             self.sockinp = 0, 0, -pi * 3 / 4, 0, 0
             new_time = get_ticks()
             print('[{0}] {3}:{4} scored {1} points in {2}ms'.format(
                 new_time, self.maze.get_score(), new_time - time, *address))
+            metrics.scores.observe(self.maze.get_score())
+            metrics.active.set(0)
             connection.close()
             if not self.hero.dead: self.maze.lose()
+            self.session.clear()
 
     def touch_control(self):
         """Handle touch control."""
+        if self.paused: return
         maze, hero = self.maze, self.hero
         if maze.target.retired: hero.firing = False
         if hero.firing:
             x, y = maze.get_pos(maze.target.x, maze.target.y)
         else:
             x, y = pygame.mouse.get_pos()
-        hero.update_angle(atan2(y - hero.y, x - hero.x))
-        self.move()
+        self.control(0, 0, atan2(y - hero.y, x - hero.x),
+                     hero.firing, hero.slashing)
 
     def user_control(self):
         """Handle direct control from user's mouse and keyboard."""
-        if self.hero.dead: return
+        if self.hero.dead or self.paused: return
         keys = pygame.key.get_pressed()
         buttons = pygame.mouse.get_pressed()
 
@@ -348,6 +516,10 @@ def main():
         '--write-config', nargs='?', const=stdout, type=FileType('w'),
         metavar='PATH', dest='defaultcfg',
         help='write default config and exit, if PATH not specified use stdout')
+    parser.add_argument(
+        '--replay', metavar='RECORD',
+        help='replay the given record and exit; use space to pause,\n'
+        'arrows to seek and change speed, or drag the progress bar')
     parser.add_argument(
         '-c', '--config', metavar='PATH',
         help='location of the configuration file (fallback: {})'.format(
@@ -380,6 +552,18 @@ def main():
         '--record-rate', metavar='SPF', dest='export_rate',
         help='snapshots of game state per second (fallback: {})'.format(
             config.export_rate))
+    parser.add_argument(
+        '--record-format', choices=WRITERS, dest='export_format',
+        help='format of game records (fallback: {})'.format(
+            config.export_format))
+    parser.add_argument(
+        '--seed', type=int,
+        help='seed of the first game, from which the following games\n'
+        'are seeded (fallback: random)')
+    parser.add_argument(
+        '--profile-trace', metavar='PATH', dest='trace',
+        help='profile frames and write their trace on exit, viewable\n'
+        'in chrome://tracing (fallback: profile on demand)')
     parser.add_argument(
         '--server', action='store_true', default=None,
         help='enable server (fallback: {})'.format(config.server))
@@ -395,6 +579,15 @@ def main():
         '-t', '--timeout', type=float,
         help='socket operations timeout in seconds (fallback: {})'.format(
             config.timeout))
+    parser.add_argument(
+        '--metrics', metavar='ADDRESS',
+        help='serve metrics in Prometheus format over HTTP on HOST:PORT,\n'
+        'PORT or unix:PATH (fallback: {})'.format(
+            config.metrics or '*disabled*'))
+    parser.add_argument(
+        '--pool', type=int, metavar='N',
+        help='number of following games to generate in the background'
+        ' (fallback: {})'.format(config.pool))
     parser.add_argument(
         '--head', action='store_false', default=None, dest='headless',
         help='run server with graphics and sound (fallback: {})'.format(
@@ -403,7 +596,8 @@ def main():
                         help='run server without graphics or sound')
     args = parser.parse_args()
     if args.defaultcfg is not None:
-        with open(SETTINGS) as settings: args.defaultcfg.write(settings.read())
+        with open(pkg_file(SETTINGS)) as settings:
+            args.defaultcfg.write(settings.read())
         args.defaultcfg.close()
         exit()
 
@@ -412,6 +606,9 @@ def main():
         config.config.read(args.config)
         config.parse()
     config.read_args(args)
+    if args.replay is not None:
+        replay(args.replay, config.size, config.max_fps)
+        exit()
 
     # Main loop
     with Game(config) as game:
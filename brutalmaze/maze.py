@@ -18,24 +18,44 @@
 
 __doc__ = 'Brutal Maze module for the maze class'
 
+import pickle
 from collections import defaultdict, deque
-import json
+from itertools import chain
 from math import pi, log
 from os import path
-from random import choice, sample
-
-import pygame
+from random import Random, choice
 
+from .audio import play
 from .characters import Hero, new_enemy
 from .constants import (
     EMPTY, WALL, HERO, ENEMY, ROAD_WIDTH, WALL_WIDTH, CELL_WIDTH, CELL_NODES,
     MAZE_SIZE, MIDDLE, INIT_SCORE, ENEMIES, SQRT2, SFX_SPAWN, SFX_MISSED,
     SFX_SLASH_ENEMY, SFX_LOSE, ADJACENTS, TANGO_VALUES, BG_COLOR, FG_COLOR,
     COLORS, HERO_HP, ENEMY_HP, ATTACK_SPEED, MAX_WOUND, HERO_SPEED,
-    BULLET_LIFETIME, JSON_SEPARATORS)
+    BULLET_LIFETIME, ENEMY_SPEED, ANGLE_DIGITS)
+from .pool import MazePool
 from .misc import (
-    sign, deg, around, regpoly, fill_aapolygon, play, json_rec)
-from .weapons import LockOn
+    sign, deg, around, regpoly, fill_aapolygon, json_rec,
+    pack_random, unpack_random)
+from .profiler import NullProfiler
+from .records import WALL_CODE, WRITERS
+from .weapons import Bullet, LockOn
+from .worker import Worker
+
+GLITCH_CODES = ''.join(COLORS[colors[0]] for colors in TANGO_VALUES)
+# Glitch colors of the grids on display are taken from this table,
+# from an offset given by the glitch's remaining time, and masked
+# by the walls, whose codes are translated to 0xff and others to 0.
+GLITCH_TABLE = ''.join(Random(0).choices(GLITCH_CODES, k=1 << 16)).encode()
+WALL_MASK = bytes.maketrans(b'0' + WALL_CODE.encode(), b'\0\xff')
+# Attributes of the simulation's state saved by Maze.snapshot
+STATE = ('fps', 'w', 'h', 'distance', 'x', 'y', 'centerx', 'centery',
+         'rangex', 'rangey', 'score', 'vx', 'vy', 'rotatex', 'rotatey',
+         'destx', 'desty', 'stepx', 'stepy', 'next_move', 'glitch',
+         'next_slashfx', 'slashd', 'next_export', 'seed')
+HERO_STATE = ('x', 'y', 'angle', 'R', 'next_heal', 'next_beat',
+              'next_strike', 'highness', 'slashing', 'firing', 'dead',
+              'spin_speed', 'spin_queue', 'wound')
 
 
 class Maze:
@@ -51,6 +71,8 @@ class Maze:
         rangex, rangey (list): range of the index of the grids on display
         score (float): current score
         map (deque of deque): map of grids representing objects on the maze
+        rows (list of str): cached codes of the displayed rows of the map,
+            None if walls on display have changed since
         vx, vy (float): velocity of the maze movement (in pixels per frame)
         rotatex, rotatey (int): grids rotated
         bullets (list of .weapons.Bullet): flying bullets
@@ -63,21 +85,43 @@ class Maze:
         glitch (float): time that the maze remain flashing colors (in ms)
         next_slashfx (float): time until next slash effect of the hero (in ms)
         slashd (float): minimum distance for slashes to be effective
-        export (list of defaultdict): records of game states
         export_dir (str): directory containing records of game states
+        export_format (str): format of records, a key of WRITERS
+        worker (Worker): thread writing records, None if not recording
+        writer (records.Writer): writer of the current game's record
         export_rate (float): milliseconds per snapshot
         next_export (float): time until next snapshot (in ms)
+        seed (int): seed of the current game
+        controls (list): arguments of the last control since the last
+            update, with the direction the hero took, None if none
+        seeder (random.Random): generator of seeds of the following games
+        rng (random.Random): generator of all randomness affecting
+            the game, so that it is reproducible from its seed and inputs
+        profiler (Profiler): profiler timing phases of updates
+        pool (MazePool): pool of pre-generated games, None if disabled
+
+    The simulation's state can be saved and restored using snapshot
+    and restore, e.g. by bots searching ahead.
     """
-    def __init__(self, fps, size, headless, export_dir, export_rate):
+    def __init__(self, fps, size, headless, export_dir, export_rate,
+                 export_format='json', seed=None, warm=0):
         self.fps = fps
+        self.seeder = Random(seed)
+        self.seed = self.seeder.getrandbits(64) if seed is None else seed
+        self.rng = Random(self.seed)
         self.w, self.h = size
         if headless:
             self.surface = None
         else:
+            import pygame
             self.surface = pygame.display.set_mode(size, pygame.RESIZABLE)
         self.export_dir = path.abspath(export_dir) if export_dir else ''
+        self.export_format = export_format
+        self.worker = Worker(name='records') if self.export_dir else None
         self.next_export = self.export_rate = export_rate
-        self.export = []
+        self.writer, self.controls = None, None
+        self.open_records()
+        self.profiler = NullProfiler()
 
         self.distance = (self.w * self.h / 416) ** 0.5
         self.x, self.y = self.w // 2, self.h // 2
@@ -86,13 +130,14 @@ class Maze:
         self.rangex = list(range(MIDDLE - w, MIDDLE + w + 1))
         self.rangey = list(range(MIDDLE - h, MIDDLE + h + 1))
         self.score = INIT_SCORE
+        self.rows = None
         self.new_map()
 
         self.vx = self.vy = 0.0
         self.rotatex = self.rotatey = 0
         self.bullets, self.enemies = [], []
         self.add_enemy()
-        self.hero = Hero(self.surface, fps, size)
+        self.hero = Hero(self.surface, fps, size, self.rng)
         self.target = LockOn(MIDDLE, MIDDLE, retired=True)
         self.next_move = self.glitch = self.next_slashfx = 0.0
         self.slashd = self.hero.R + self.distance/SQRT2
@@ -100,6 +145,10 @@ class Maze:
         self.sfx_spawn = SFX_SPAWN
         self.sfx_slash = SFX_SLASH_ENEMY
         self.sfx_lose = SFX_LOSE
+        if warm:
+            self.pool = MazePool(warm, fps, size, export_rate, self.seeder)
+        else:
+            self.pool = None
 
     def new_cell(self, x, y):
         """Draw on the map a newly created cell
@@ -113,8 +162,8 @@ class Maze:
 
         x, y = x * CELL_WIDTH, y * CELL_WIDTH
         draw_bit(WALL)
-        walls = set(sample(ADJACENTS, 2))
-        walls.add(choice(ADJACENTS))
+        walls = set(self.rng.sample(ADJACENTS, 2))
+        walls.add(self.rng.choice(ADJACENTS))
         for i, j in ADJACENTS:
             draw_bit((WALL if (i, j) in walls else EMPTY), i, j)
 
@@ -139,13 +188,14 @@ class Maze:
             if bit not in visited:
                 if not self.isdisplayed(*bit): break
                 visited.add(bit)
-                for x, y in around(*bit):
+                for x, y in around(*bit, self.rng):
                     if self.map[x][y] == EMPTY: room.append((x, y))
         else:
             self.new_map()
         self.map[MIDDLE][MIDDLE] = HERO
         self.destx = self.desty = MIDDLE
         self.stepx = self.stepy = 0
+        self.rows = None
 
     def add_enemy(self):
         """Add enough enemies."""
@@ -153,10 +203,10 @@ class Maze:
         walls = [(i, j) for i in self.rangex for j in self.rangey
                  if self.map[i][j] == WALL]
         plums = [e for e in self.enemies if e.color == 'Plum' and e.awake]
-        plum = choice(plums) if plums else None
+        plum = self.rng.choice(plums) if plums else None
         num = log(self.score, INIT_SCORE)
         while walls and len(self.enemies) < num:
-            x, y = choice(walls)
+            x, y = self.rng.choice(walls)
             if all(self.map[x + a][y + b] == WALL for a, b in ADJACENTS):
                 continue
             enemy = new_enemy(self, x, y)
@@ -188,12 +238,34 @@ class Maze:
         """Return the current score."""
         return int(self.score - INIT_SCORE)
 
+    def get_rows(self):
+        """Return the codes of the displayed rows of the map,
+        recolored if the maze is glitching.
+        """
+        if self.rows is None:
+            columns = [self.map[x] for x in self.rangex]
+            self.rows = [''.join([WALL_CODE if column[y] == WALL else '0'
+                                  for column in columns])
+                         for y in self.rangey]
+        if self.glitch <= 0 or not self.rows: return self.rows
+        # Offset by the glitch's remaining time, which floats hash
+        # consistently, so that regenerated snapshots have the same colors.
+        width, size = len(self.rows[0]), len(self.rows[0]) * len(self.rows)
+        start = hash(self.glitch) % (len(GLITCH_TABLE) - size)
+        walls = ''.join(self.rows).encode().translate(WALL_MASK)
+        # All grids are masked at once as a single big integer.
+        cells = (int.from_bytes(walls, 'big') & int.from_bytes(
+            GLITCH_TABLE[start:start+size], 'big')).to_bytes(size, 'big')
+        cells = cells.replace(b'\0', b'0').decode()
+        return [cells[i:i+width] for i in range(0, size, width)]
+
     def get_color(self):
         """Return color of a grid."""
         return choice(TANGO_VALUES)[0] if self.glitch > 0 else FG_COLOR
 
     def draw(self):
         """Draw the maze."""
+        import pygame
         self.surface.fill(BG_COLOR)
         if self.next_move <= 0:
             for i in self.rangex:
@@ -207,6 +279,7 @@ class Maze:
         if not self.hero.dead: self.hero.draw()
         bullet_radius = self.distance / 4
         for bullet in self.bullets: bullet.draw(bullet_radius)
+        self.profiler.draw(self.surface)
         pygame.display.flip()
         pygame.display.set_caption(
             'Brutal Maze - Score: {}'.format(self.get_score()))
@@ -216,6 +289,7 @@ class Maze:
         x = int((self.centerx-self.x) * 2 / self.distance)
         y = int((self.centery-self.y) * 2 / self.distance)
         if x == y == 0: return
+        self.rows = None
         for enemy in self.enemies:
             if self.map[enemy.x][enemy.y] == ENEMY:
                 self.map[enemy.x][enemy.y] = EMPTY
@@ -269,7 +343,7 @@ class Maze:
             # If called by close-range attack, this is FPS-dependant, although
             # in playable FPS (24 to infinity), the difference within 2%.
             self.hero.next_heal = abs(self.hero.next_heal * (1 - wound))
-        elif choice(ENEMIES) == color:
+        elif self.rng.choice(ENEMIES) == color:
             self.hero.next_heal = -1.0  # what doesn't kill you heals you
             if color == 'Butter' or color == 'ScarletRed':
                 wound *= ENEMY_HP
@@ -321,6 +395,7 @@ class Maze:
                     enemy = new_enemy(self, gridx, gridy)
                     enemy.awake = True
                     self.map[gridx][gridy] = ENEMY
+                    self.rows = None
                     play(SFX_SPAWN, enemy.x, enemy.y)
                     enemy.hit(wound)
                     self.enemies.append(enemy)
@@ -370,42 +445,49 @@ class Maze:
         cy = len(self.rangey)*50 + (y - self.centery)/self.distance*100
         return round(cx), round(cy)
 
-    def update_export(self, forced=False):
-        """Update the maze's data export and return the last record."""
+    def update_export(self, forced=False, fields='meb'):
+        """Update the maze's data export and return the last record.
+
+        Only the hero and the given fields among the map (m),
+        enemies (e) and bullets (b) are computed, unless the record
+        is due to be written.
+        """
         if self.next_export > 0 and not forced or self.hero.dead: return
+        if self.next_export <= 0 and self.writer is not None: fields = 'meb'
         export = defaultdict(list)
         export['s'] = self.get_score()
 
-        if self.next_move <= 0:
-            for y in self.rangey:
-                export['m'].append(''.join(
-                    COLORS[self.get_color()] if self.map[x][y] == WALL else '0'
-                    for x in self.rangex))
+        if 'm' in fields and self.next_move <= 0:
+            export['m'] = self.get_rows()
 
         x, y = self.expos(self.x, self.y)
         export['h'] = [
             COLORS[self.hero.get_color()], x, y, deg(self.hero.angle),
             int(self.hero.next_strike <= 0), int(self.hero.next_heal <= 0)]
 
-        for enemy in self.enemies:
+        for enemy in self.enemies if 'e' in fields else ():
             if enemy.isunnoticeable(): continue
             x, y = self.expos(*enemy.pos)
             color, angle = COLORS[enemy.get_color()], deg(enemy.angle)
             export['e'].append([color, x, y, angle])
 
-        for bullet in self.bullets:
+        for bullet in self.bullets if 'b' in fields else ():
             x, y = self.expos(bullet.x, bullet.y)
             color, angle = COLORS[bullet.get_color()], deg(bullet.angle)
             if color != '0': export['b'].append([color, x, y, angle])
 
         if self.next_export <= 0:
             export['t'] = round(self.export_rate - self.next_export)
-            self.export.append(export)
+            # Copy so that later lookups do not mutate what is written.
+            if self.writer is not None: self.writer.write(dict(export))
             self.next_export = self.export_rate
         return export
 
     def update(self, fps):
         """Update the maze."""
+        if self.writer is not None: self.writer.log(self, fps)
+        self.controls = None
+        profiler = self.profiler
         self.fps = fps
         self.vx = self.is_valid_move(vx=self.vx)
         self.centerx += self.vx
@@ -416,24 +498,32 @@ class Maze:
         self.glitch -= 1000 / fps
         self.next_slashfx -= 1000 / fps
         self.next_export -= 1000 / fps
+        profiler.lap('move')
 
         self.rotate()
+        profiler.lap('rotate')
         if self.vx or self.vy or self.hero.firing or self.hero.slashing:
             for enemy in self.enemies: enemy.wake()
             for bullet in self.bullets: bullet.place(self.vx, self.vy)
 
         for enemy in self.enemies: enemy.update()
+        profiler.lap('enemies')
         self.track_bullets()
+        profiler.lap('bullets')
         if not self.hero.dead:
             self.hero.update(fps)
             self.slash()
             if self.hero.wound >= HERO_HP: self.lose()
+        profiler.lap('hero')
         self.update_export()
+        profiler.lap('export')
 
     def resize(self, size):
         """Resize the maze."""
         self.w, self.h = size
-        self.surface = pygame.display.set_mode(size, pygame.RESIZABLE)
+        if self.surface is not None:
+            import pygame
+            self.surface = pygame.display.set_mode(size, pygame.RESIZABLE)
         self.hero.resize(size)
 
         offsetx = (self.centerx-self.x) / self.distance
@@ -446,12 +536,14 @@ class Maze:
         self.rangex = list(range(MIDDLE - w, MIDDLE + w + 1))
         self.rangey = list(range(MIDDLE - h, MIDDLE + h + 1))
         self.slashd = self.hero.R + self.distance/SQRT2
+        self.rows = None
 
     def set_step(self, check=(lambda x, y: True)):
         """Work out next step on the shortest path to the destination.
 
         Return whether target is impossible to reach and hero should
-        shoot toward it instead.
+        shoot toward it instead.  Being a control rather than part of
+        the simulation, path finding does not draw from rng.
         """
         if self.stepx or self.stepy and self.vx == self.vy == 0.0:
             x, y = MIDDLE - self.stepx, MIDDLE - self.stepy
@@ -490,15 +582,73 @@ class Maze:
         self.stepx = self.stepy = 0
         return True
 
+    def move(self, x=0, y=0):
+        """Command the hero to move faster in the given direction,
+        or along the path to the destination by default,
+        and return the direction taken.
+        """
+        velocity = self.distance * HERO_SPEED / self.fps
+        accel = velocity * HERO_SPEED / self.fps
+
+        if x == y == 0:
+            self.set_step()
+            x, y = self.stepx, self.stepy
+        else:
+            x, y = -x, -y   # or move the maze in the reverse direction
+
+        if self.next_move > 0 or not x:
+            self.vx -= sign(self.vx) * accel
+            if abs(self.vx) < accel * 2: self.vx = 0.0
+        elif x * self.vx < 0:
+            self.vx += x * 2 * accel
+        else:
+            self.vx += x * accel
+            if abs(self.vx) > velocity: self.vx = x * velocity
+
+        if self.next_move > 0 or not y:
+            self.vy -= sign(self.vy) * accel
+            if abs(self.vy) < accel * 2: self.vy = 0.0
+        elif y * self.vy < 0:
+            self.vy += y * 2 * accel
+        else:
+            self.vy += y * accel
+            if abs(self.vy) > velocity: self.vy = y * velocity
+        return -x, -y
+
+    def control(self, x, y, angle, firing, slashing):
+        """Control how the hero move and attack.
+
+        The angle is rounded so that controls logged by input writers
+        stay short and repeat while the aim does not move.
+        """
+        angle = round(angle, ANGLE_DIGITS)
+        x, y = self.move(x, y)
+        self.hero.update_angle(angle)
+        self.hero.firing = firing
+        self.hero.slashing = slashing
+        self.controls = [x, y, angle, firing, slashing]
+
     def isfast(self):
         """Return if the hero is moving faster than HERO_SPEED."""
         return (self.vx**2+self.vy**2)**0.5*self.fps > HERO_SPEED*self.distance
 
-    def dump_records(self):
-        """Dump JSON records."""
+    def open_records(self):
+        """Start recording a new game if recording is enabled."""
         if self.export_dir:
-            with open(json_rec(self.export_dir), 'w') as f:
-                json.dump(self.export, f, separators=JSON_SEPARATORS)
+            writer = WRITERS[self.export_format]
+            self.writer = writer(json_rec(self.export_dir, writer.extension),
+                                 self.worker)
+
+    def dump_records(self):
+        """Finish the record of the current game in the background."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close(self):
+        """Finish writing records and stop pre-generating games."""
+        if self.worker is not None: self.worker.close()
+        if self.pool is not None: self.pool.close()
 
     def lose(self):
         """Handle loses."""
@@ -511,20 +661,111 @@ class Maze:
         play(SFX_LOSE)
         self.dump_records()
 
-    def reinit(self):
-        """Open new game."""
+    def snapshot(self):
+        """Return the state of the simulation, including that of
+        its random generators, as compact bytes.
+
+        The display, audio and records are left out, so that
+        the snapshot can be sent to other processes and restored
+        into any maze.
+        """
+        enemies, target = list(self.enemies), self.target
+        if isinstance(target, LockOn):
+            target = target.x, target.y, target.retired
+        else:
+            # The target may have died and left the enemies.
+            try:
+                target = enemies.index(target)
+            except ValueError:
+                enemies.append(target)
+                target = len(enemies) - 1
+        return pickle.dumps((
+            [getattr(self, key) for key in STATE],
+            bytes(chain.from_iterable(self.map)), len(self.map[0]),
+            pack_random(self.rng), pack_random(self.seeder),
+            [getattr(self.hero, key) for key in HERO_STATE],
+            tuple(self.hero.wounds),
+            [(type(enemy), {key: value for key, value in vars(enemy).items()
+                            if key != 'maze'}) for enemy in enemies],
+            len(self.enemies), target,
+            [(bullet.x, bullet.y, bullet.angle, bullet.color,
+              bullet.fall_time) for bullet in self.bullets]),
+            pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, snapshot):
+        """Restore the simulation to the state in the snapshot.
+
+        Recording goes on in the current record, if any.
+        """
+        (state, grids, height, rng, seeder, hero, wounds, enemies, alive,
+         target, bullets) = pickle.loads(snapshot)
+        for key, value in zip(STATE, state): setattr(self, key, value)
+        self.map = deque(deque(grids[i:i+height])
+                         for i in range(0, len(grids), height))
+        self.rows = None
+        unpack_random(self.rng, rng)
+        unpack_random(self.seeder, seeder)
+        for key, value in zip(HERO_STATE, hero): setattr(self.hero, key, value)
+        self.hero.wounds = deque(wounds)
+
+        characters = []
+        for cls, attributes in enemies:
+            enemy = cls.__new__(cls)
+            enemy.__dict__.update(attributes, maze=self)
+            characters.append(enemy)
+        self.enemies = characters[:alive]
+        if isinstance(target, int):
+            self.target = characters[target]
+        else:
+            self.target = LockOn(*target)
+        self.bullets = []
+        for x, y, angle, color, fall_time in bullets:
+            bullet = Bullet(self.surface, x, y, angle, color)
+            bullet.fall_time = fall_time
+            self.bullets.append(bullet)
+
+    def reinit(self, seed=None):
+        """Open new game, seeded by the given seed or the next one
+        drawn from seeder.
+
+        Games of seeds drawn from seeder are taken from the pool
+        if they have been generated.
+        """
+        self.seed = self.seeder.getrandbits(64) if seed is None else seed
+        if seed is None and self.pool is not None:
+            game = self.pool.get(self.seed, (self.w, self.h), self.seeder)
+        else:
+            game = None
         self.centerx, self.centery = self.w / 2, self.h / 2
-        self.score, self.export = INIT_SCORE, []
-        self.new_map()
+        self.dump_records()
+        self.open_records()
+        self.controls = None
+        self.score = INIT_SCORE
         self.vx = self.vy = 0.0
         self.rotatex = self.rotatey = 0
-        self.bullets, self.enemies = [], []
-        self.add_enemy()
+        self.bullets = []
+        if game is None:
+            self.rng.seed(self.seed)
+            self.new_map()
+            self.enemies = []
+            self.add_enemy()
+        else:
+            self.map, self.enemies, state = game
+            self.rng.setstate(state)
+            self.destx = self.desty = MIDDLE
+            self.stepx = self.stepy = 0
+            self.rows = None
+            for enemy in self.enemies:
+                enemy.maze = self
+                enemy.move_speed = self.fps / ENEMY_SPEED
+                enemy.spin_speed = self.fps / ENEMY_HP
 
         self.next_move = self.next_slashfx = self.hero.next_strike = 0.0
+        self.glitch, self.next_export = 0.0, self.export_rate
         self.target = LockOn(MIDDLE, MIDDLE, retired=True)
         self.hero.next_heal = -1.0
         self.hero.highness = 0.0
         self.hero.slashing = self.hero.firing = self.hero.dead = False
         self.hero.spin_queue = self.hero.wound = 0.0
+        self.hero.spin_speed = self.fps / HERO_HP
         self.hero.wounds = deque([0.0])
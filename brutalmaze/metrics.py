@@ -0,0 +1,197 @@
+# metrics.py - module for exposing server metrics
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for exposing server metrics'
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os import path, remove
+from socketserver import ThreadingMixIn, UnixStreamServer
+from threading import Thread
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNIX_PREFIX = 'unix:'
+TICK_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                0.01, 0.025, 0.05, 0.1)  # s
+SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384)    # bytes
+SCORE_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class Counter:
+    """Monotonically increasing metric.
+
+    Attributes:
+        name (str): name of the metric
+        help (str): description of the metric
+        value (float): current value
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name, self.help, self.value = name, help, 0
+
+    def inc(self, amount=1):
+        """Increase the value by the given amount."""
+        self.value += amount
+
+    def samples(self):
+        """Yield the metric's lines of samples."""
+        yield '{} {}'.format(self.name, self.value)
+
+    def render(self):
+        """Return the metric in Prometheus text format."""
+        return '# HELP {0} {1}\n# TYPE {0} {2}\n{3}\n'.format(
+            self.name, self.help, self.kind, '\n'.join(self.samples()))
+
+
+class Gauge(Counter):
+    """Metric which can go up and down."""
+    kind = 'gauge'
+
+    def set(self, value):
+        """Set the current value."""
+        self.value = value
+
+
+class Histogram(Counter):
+    """Metric counting observations in cumulative buckets.
+
+    Additional attributes:
+        buckets (tuple of float): upper bounds of the buckets
+        counts (list of int): observations in each bucket,
+            the last one being for those above all bounds
+        sum (float): sum of all observations
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        Counter.__init__(self, name, help)
+        self.buckets, self.counts = buckets, [0] * (len(buckets)+1)
+        self.sum = 0
+
+    def observe(self, value):
+        """Count the given observation."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """Yield the metric's lines of samples."""
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield '{}_bucket{{le="{}"}} {}'.format(self.name, bound, total)
+        yield '{}_sum {}'.format(self.name, self.sum)
+        yield '{}_count {}'.format(self.name, total)
+
+
+class Metrics:
+    """Metrics of the socket server and the main loop.
+
+    Values are updated without locking by the main loop and the
+    server's thread, which is fine for scraping since each metric
+    is only written from one of them.
+
+    Attributes:
+        sessions (Counter): sessions accepted
+        active (Gauge): sessions in progress
+        timeouts (Counter): sessions ended by a client timing out
+        observations (Counter): observations sent to clients
+        size (Histogram): sizes of observations (in bytes)
+        first (Histogram): delays from accepting a connection
+            to sending the first observation (in s)
+        scores (Histogram): scores of finished sessions
+        ticks (Counter): frames simulated
+        tick (Histogram): durations of simulating a frame (in s)
+        fps (Gauge): frame rate achieved
+        target (Gauge): frame rate aimed for
+        limit (Gauge): frame rate the loop is currently limited to
+    """
+    def __init__(self):
+        self.sessions = Counter('brutalmaze_sessions_total',
+                                'Sessions accepted by the socket server.')
+        self.active = Gauge('brutalmaze_sessions_active',
+                            'Sessions in progress.')
+        self.timeouts = Counter('brutalmaze_timeouts_total',
+                                'Sessions ended by the client timing out.')
+        self.observations = Counter('brutalmaze_observations_total',
+                                    'Observations sent to clients.')
+        self.size = Histogram('brutalmaze_observation_bytes',
+                              'Sizes of observations sent to clients.',
+                              SIZE_BUCKETS)
+        self.first = Histogram('brutalmaze_first_observation_seconds',
+                               'Delays from accepting a connection to sending'
+                               ' the first observation.', TICK_BUCKETS)
+        self.scores = Histogram('brutalmaze_session_score',
+                                'Scores of finished sessions.', SCORE_BUCKETS)
+        self.ticks = Counter('brutalmaze_ticks_total', 'Frames simulated.')
+        self.tick = Histogram('brutalmaze_tick_seconds',
+                              'Durations of simulating a frame.', TICK_BUCKETS)
+        self.fps = Gauge('brutalmaze_fps', 'Frame rate achieved.')
+        self.target = Gauge('brutalmaze_fps_target', 'Frame rate aimed for.')
+        self.limit = Gauge('brutalmaze_fps_limit',
+                           'Frame rate the main loop is currently limited to.')
+
+    def render(self):
+        """Return all metrics in Prometheus text format."""
+        return ''.join(metric.render() for metric in vars(self).values())
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Handler serving the server's metrics on any GET request."""
+    def do_GET(self):
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        """Return the client address, empty over Unix sockets."""
+        return str(self.client_address and self.client_address[0])
+
+    def log_message(self, format, *args):
+        """Keep scrapes out of the game's output."""
+
+
+class TCPHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server listening on a TCP port."""
+    daemon_threads = True
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """HTTP server listening on a Unix socket."""
+    daemon_threads = True
+
+
+def serve(metrics, address):
+    """Serve the metrics over HTTP in a background thread and return
+    the server.
+
+    address is either HOST:PORT, PORT (on localhost) or unix:PATH.
+    """
+    if address.startswith(UNIX_PREFIX):
+        filename = address[len(UNIX_PREFIX):]
+        if path.exists(filename): remove(filename)
+        server = UnixHTTPServer(filename, Handler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = TCPHTTPServer((host or 'localhost', int(port)), Handler)
+    server.metrics = metrics
+    Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
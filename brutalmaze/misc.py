@@ -18,22 +18,31 @@
 
 __doc__ = 'Brutal Maze module for miscellaneous functions'
 
+from array import array
 from datetime import datetime
 from itertools import chain
 from math import degrees, cos, sin, pi
 from os import path
-from random import shuffle
+import random
 
-import pygame
-from pygame.gfxdraw import filled_polygon, aapolygon
-from palace import Buffer, Source
+from .constants import ADJACENTS, CORNERS
 
-from .constants import ADJACENTS, CORNERS, MIDDLE
 
+def randsign(rng=random):
+    """Return either -1 or 1 randomly, drawn from the generator rng."""
+    return rng.choice((-1, 1))
 
-def randsign():
-    """Return either -1 or 1 (kind of) randomly."""
-    return (pygame.time.get_ticks() & 1)*2 - 1
+
+def pack_random(rng):
+    """Return the state of the generator rng in a compact form."""
+    version, internal, gauss = rng.getstate()
+    return version, array('I', internal).tobytes(), gauss
+
+
+def unpack_random(rng, state):
+    """Restore the generator rng to the state packed by pack_random."""
+    version, internal, gauss = state
+    rng.setstate((version, tuple(array('I', internal)), gauss))
 
 
 def regpoly(n, R, r, x, y):
@@ -48,6 +57,9 @@ def regpoly(n, R, r, x, y):
 
 def fill_aapolygon(surface, points, color):
     """Draw a filled polygon with anti-aliased edges onto a surface."""
+    # Pygame is only imported when drawing so that headless simulation
+    # does not depend on it.
+    from pygame.gfxdraw import filled_polygon, aapolygon
     aapolygon(surface, points, color)
     filled_polygon(surface, points, color)
 
@@ -73,28 +85,22 @@ def join(iterable, sep=' ', end='\n'):
     return sep.join(map(str, iterable)) + end
 
 
-def around(x, y):
-    """Return grids around the given one in random order."""
+def around(x, y, rng=random):
+    """Return grids around the given one in an order shuffled
+    by the generator rng.
+    """
     a = [(x + i, y + j) for i, j in ADJACENTS]
-    shuffle(a)
+    rng.shuffle(a)
     c = [(x + i, y + j) for i, j in CORNERS]
-    shuffle(c)
+    rng.shuffle(c)
     return chain(a, c)
 
 
-def json_rec(directory):
-    """Return path to JSON file to be created inside the given directory
-    based on current time local to timezone in ISO 8601 format.
+def json_rec(directory, extension='json'):
+    """Return path to record file to be created inside the given
+    directory based on current time local to timezone in ISO 8601 format,
+    down to the microsecond so that games finished within the same
+    second do not overwrite each other's records.
     """
-    return path.join(
-        directory, '{}.json'.format(datetime.now().isoformat()[:19]))
-
-
-def play(sound: str, x: float = MIDDLE, y: float = MIDDLE,
-         gain: float = 1.0) -> Source:
-    """Play a sound at the given position."""
-    source = Buffer(sound).play()
-    source.spatialize = True
-    source.position = x, -y, 0
-    source.gain = gain
-    return source
+    return path.join(directory, '{}.{}'.format(
+        datetime.now().isoformat(timespec='microseconds'), extension))
@@ -0,0 +1,106 @@
+# pool.py - module for pre-generating mazes
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for pre-generating mazes'
+
+from queue import Empty, Queue
+from random import Random
+from threading import Lock, Thread
+
+from .constants import INIT_SCORE
+
+
+class MazePool:
+    """Bounded pool of maps and initial enemies of the following
+    games, generated in a daemon thread.
+
+    The seeds of the following games are predicted by a copy of
+    the maze's seeder, and each game is generated on a scratch maze
+    exactly as Maze.reinit would, so pulling from the pool does not
+    change the games.  Whenever the prediction turns out wrong,
+    e.g. after a resize, the pool starts over from the current seeder.
+
+    Attributes:
+        queue (Queue): generated games, each being the generation,
+            seed, display size, map, enemies and the state of rng after
+            generating them
+        lock (Lock): lock guarding the following attributes
+        generation (int): number of times the pool has started over
+        seeds (random.Random): copy of the seeder drawing the seeds
+            of the games to be generated
+        size (tuple of int): size of the display
+        thread (Thread): the thread generating games
+    """
+    def __init__(self, maxsize, fps, size, export_rate, seeder):
+        self.queue, self.lock = Queue(maxsize), Lock()
+        self.generation, self.seeds = 0, Random()
+        self.seeds.setstate(seeder.getstate())
+        self.size = size
+        self.thread = Thread(target=self.run, name='mazes',
+                             args=(fps, export_rate), daemon=True)
+        self.thread.start()
+
+    def run(self, fps, export_rate):
+        """Generate games until the pool is closed."""
+        from .maze import Maze
+        scratch = None
+        while True:
+            with self.lock:
+                if self.generation is None: break
+                generation, size = self.generation, self.size
+                seed = self.seeds.getrandbits(64)
+            if scratch is None:
+                scratch = Maze(fps, size, True, '', export_rate, seed=0)
+            elif (scratch.w, scratch.h) != size:
+                scratch.resize(size)
+            scratch.rng.seed(seed)
+            scratch.score = INIT_SCORE
+            scratch.new_map()
+            scratch.enemies = []
+            scratch.add_enemy()
+            self.queue.put((generation, seed, size, scratch.map,
+                            scratch.enemies, scratch.rng.getstate()))
+
+    def get(self, seed, size, seeder):
+        """Return the map, enemies and state of rng of the game
+        of the given seed and display size, or None if it has not
+        been generated, in which case the pool starts over from
+        the seeder.
+        """
+        while True:
+            try:
+                generation, *game = self.queue.get_nowait()
+            except Empty:
+                break
+            if generation == self.generation and game[:2] == [seed, size]:
+                return game[2:]
+        with self.lock:
+            self.generation += 1
+            self.seeds.setstate(seeder.getstate())
+            self.size = size
+        return None
+
+    def close(self):
+        """Stop generating games."""
+        with self.lock: self.generation = None
+        # Unblock the thread if it is waiting for room.
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except Empty:
+                pass
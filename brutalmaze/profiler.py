@@ -0,0 +1,141 @@
+# profiler.py - module for profiling frames
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for profiling frames'
+
+import json
+from collections import deque
+from time import perf_counter_ns
+
+from .constants import BG_COLOR, FG_COLOR, JSON_SEPARATORS
+
+WINDOW = 256    # frames
+TRACE_LIMIT = 1 << 20   # laps
+BUCKETS = 12    # powers of two from 1 µs
+FONT_SIZE = 18  # px
+BAR_WIDTH = 4   # px
+OVERLAY_ALPHA = 192
+
+
+class NullProfiler:
+    """Profiler timing nothing, used unless profiling is enabled
+    so that instrumentation only costs an empty call per phase.
+    """
+    def lap(self, phase): pass
+
+    def draw(self, surface): pass
+
+    def dump(self, filename): pass
+
+
+class Profiler:
+    """Profiler timing consecutive phases of frames.
+
+    Each lap ends the phase of the given name, which started at
+    the previous lap, so the phases of a frame add up to its duration.
+
+    Attributes:
+        last (int): time of the last lap (in ns)
+        origin (int): time the profiler was created (in ns)
+        durations (dict of deque): durations of each phase
+            in the last WINDOW frames (in ns)
+        laps (deque of tuple): phase, start and duration of the last
+            TRACE_LIMIT laps, to be exported as a trace
+        overlay (bool): flag indicating if statistics are drawn
+        font (pygame.font.Font): font of the overlay, None until drawn
+    """
+    def __init__(self, window=WINDOW, trace_limit=TRACE_LIMIT):
+        self.window = window
+        self.last = self.origin = perf_counter_ns()
+        self.durations, self.laps = {}, deque(maxlen=trace_limit)
+        self.overlay, self.font = False, None
+
+    def lap(self, phase):
+        """End the current phase of the given name."""
+        now = perf_counter_ns()
+        duration = now - self.last
+        try:
+            self.durations[phase].append(duration)
+        except KeyError:
+            self.durations[phase] = deque([duration], self.window)
+        self.laps.append((phase, self.last, duration))
+        self.last = now
+
+    def stats(self, phase):
+        """Return the median, the 95th percentile and the maximum
+        of the phase's recent durations (in ms).
+        """
+        durations = sorted(self.durations[phase])
+        n = len(durations)
+        return (durations[n // 2] / 1e6, durations[n * 19 // 20] / 1e6,
+                durations[-1] / 1e6)
+
+    def histogram(self, phase):
+        """Return counts of the phase's recent durations in buckets,
+        the i-th of which holds durations of about 2**(i-1) to 2**i µs
+        and the last one also the longer ones.
+        """
+        counts = [0] * BUCKETS
+        for duration in self.durations[phase]:
+            counts[min(max(duration.bit_length() - 10, 0), BUCKETS - 1)] += 1
+        return counts
+
+    def draw(self, surface):
+        """Draw the statistics of each phase onto the surface
+        if the overlay is shown.
+        """
+        if not self.overlay: return
+        import pygame
+        if self.font is None:
+            self.font = pygame.font.SysFont('monospace', FONT_SIZE)
+        lines = ['{:8} {:>6} {:>6} {:>6}'.format('ms', 'p50', 'p95', 'max')]
+        lines.extend('{:8} {:6.2f} {:6.2f} {:6.2f}'.format(phase, *self.stats(
+            phase)) for phase in self.durations)
+        texts = [self.font.render(line, True, FG_COLOR) for line in lines]
+        width = max(text.get_width() for text in texts)
+        height = texts[0].get_height()
+
+        overlay = pygame.Surface(
+            (width + BAR_WIDTH*(BUCKETS+2), height * len(texts)),
+            pygame.SRCALPHA)
+        overlay.fill((*BG_COLOR, OVERLAY_ALPHA))
+        for i, text in enumerate(texts): overlay.blit(text, (0, height * i))
+        for i, phase in enumerate(self.durations, 1):
+            counts = self.histogram(phase)
+            top = max(counts)
+            for j, count in enumerate(counts):
+                bar = round(count / top * (height-2))
+                overlay.fill(FG_COLOR, (width + BAR_WIDTH*(j+1),
+                                        height*(i+1) - 1 - bar,
+                                        BAR_WIDTH - 1, bar))
+        surface.blit(overlay, (0, 0))
+
+    def trace(self):
+        """Return the recorded laps in Chrome's trace event format."""
+        return {'traceEvents': [
+            {'name': phase, 'ph': 'X', 'pid': 0, 'tid': 0,
+             'ts': (start-self.origin) / 1000, 'dur': duration / 1000}
+            for phase, start, duration in self.laps],
+            'displayTimeUnit': 'ms'}
+
+    def dump(self, filename):
+        """Write the recorded laps to the given file as a trace
+        viewable in chrome://tracing or Perfetto.
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.trace(), f, separators=JSON_SEPARATORS)
@@ -0,0 +1,623 @@
+# records.py - module for reading and writing game records
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for reading and writing game records'
+
+import json
+from argparse import ArgumentParser
+from bisect import bisect
+from itertools import accumulate
+from multiprocessing import Pool
+from os import path, replace, SEEK_END
+from struct import Struct
+from time import monotonic
+from zlib import compress, decompress
+
+from .constants import COLOR_CODE, COLORS, FG_COLOR, JSON_SEPARATORS
+
+FLUSH_INTERVAL = 1.0    # s
+PARTIAL_SUFFIX = '.part'
+
+MAGIC = b'BMZR'
+VERSION = 2
+BLOCK_SIZE = 150    # snapshots
+BLOCK_HEADER = Struct('<I')
+TRAILER = Struct('<Q4s')
+CODES = {c: i for i, c in enumerate(COLOR_CODE)}
+WALL_BITS = str.maketrans({c: '1' for c in COLOR_CODE[:-1]})
+WALL_CODE = COLORS[FG_COLOR]
+
+
+class Writer:
+    """Base of writers streaming snapshots of a game to a record.
+
+    Snapshots are encoded and appended as they come, by the given
+    worker if any, so memory use does not grow with the length of
+    the game.  The record is written to a partial file next to the
+    destination, which is only moved in place once finalized.
+    The file is only created with the first entry, so games
+    without any leave no record behind.  Subclasses define
+    dump(snapshot), appending an entry to the partial file.
+
+    Attributes:
+        filename (str): path to the finished record
+        worker (Worker): thread doing the writing, None to write
+            synchronously
+        started (bool): whether the file is created or scheduled to be
+        file (io.IOBase): the partial file being written
+    """
+    extension = mode = None
+
+    def __init__(self, filename, worker=None):
+        self.filename, self.worker = filename, worker
+        self.started, self.file = False, None
+
+    def schedule(self, func, *args):
+        """Call func(*args) by the worker, or right away if there is
+        no worker.
+        """
+        if self.worker is None:
+            func(*args)
+        else:
+            self.worker.submit(func, *args)
+
+    def start(self):
+        """Schedule the partial file to be created, if it is not yet."""
+        if self.started: return
+        self.started = True
+        self.schedule(self.open)
+
+    def open(self):
+        """Create the partial file."""
+        self.file = open(self.filename + PARTIAL_SUFFIX, self.mode)
+
+    def write(self, snapshot):
+        """Schedule the snapshot to be appended."""
+        self.start()
+        self.schedule(self.dump, snapshot)
+
+    def log(self, maze, fps):
+        """Take note of the maze's controls before it is updated
+        at the given frame rate.
+        """
+
+    def close(self):
+        """Schedule the record to be finalized, if it is started."""
+        if self.started: self.schedule(self.finalize)
+
+    def finalize(self):
+        """Close the partial file and move the record in place."""
+        self.file.close()
+        replace(self.filename + PARTIAL_SUFFIX, self.filename)
+
+
+class JSONWriter(Writer):
+    """Writer streaming snapshots of a game to a JSON array,
+    which is flushed every FLUSH_INTERVAL seconds.
+
+    Should the game crash, what has been flushed can be read by load.
+
+    Additional attributes:
+        separator (str): string to be written before the next snapshot
+        next_flush (float): time of the next flush (in s)
+    """
+    extension, mode = 'json', 'w'
+
+    def open(self):
+        """Create the partial file and start the array."""
+        Writer.open(self)
+        self.file.write('[')
+        self.separator = ''
+        self.next_flush = monotonic() + FLUSH_INTERVAL
+
+    def dump(self, snapshot):
+        """Append the snapshot to the array."""
+        self.file.write(self.separator)
+        self.file.write(json.dumps(snapshot, separators=JSON_SEPARATORS))
+        self.separator = ','
+        if monotonic() > self.next_flush:
+            self.file.flush()
+            self.next_flush = monotonic() + FLUSH_INTERVAL
+
+    def finalize(self):
+        """Close the array and move the record in place."""
+        self.file.write(']')
+        Writer.finalize(self)
+
+
+def put_uint(buf, n):
+    """Append the nonnegative integer n to buf as a varint."""
+    while n > 0x7f:
+        buf.append(n & 0x7f | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def put_int(buf, n):
+    """Append the integer n to buf as a zigzag-encoded varint."""
+    put_uint(buf, n*2 if n >= 0 else -n*2 - 1)
+
+
+def get_uint(data, i):
+    """Return the varint starting at data[i] and the index after it."""
+    n = shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80: return n, i
+        shift += 7
+
+
+def get_int(data, i):
+    """Return the zigzag-encoded varint starting at data[i]
+    and the index after it.
+    """
+    n, i = get_uint(data, i)
+    return (n >> 1 if n & 1 == 0 else -(n >> 1) - 1), i
+
+
+class Codec:
+    """State shared by the encoder and decoder of a block of
+    binary record, in which snapshots are delta-encoded against
+    the previous one.
+
+    Attributes:
+        score (int): score of the previous snapshot
+        size (tuple of int): width and height of the previous map
+        walls (int): wall plane of the previous map, one bit per grid
+        hero (list): hero of the previous snapshot
+        enemies, bullets (list of list): entities of the previous snapshot
+    """
+    def __init__(self):
+        self.score, self.size, self.walls = 0, (0, 0), 0
+        self.hero, self.enemies, self.bullets = [0] * 6, [], []
+
+    def encode(self, buf, snapshot):
+        """Append the snapshot encoded to buf."""
+        rows = snapshot.get('m')
+        flags = ('t' in snapshot) | bool(rows) << 1 | ('e' in snapshot) << 3
+        flags |= ('b' in snapshot) << 4
+        if rows:
+            walls = ''.join(rows)
+            colored = not set(walls) <= {'0', WALL_CODE}
+            flags |= colored << 2
+        buf.append(flags)
+        put_int(buf, snapshot['s'] - self.score)
+        self.score = snapshot['s']
+        if 't' in snapshot: put_uint(buf, snapshot['t'])
+
+        if rows:
+            size = len(rows[0]), len(rows)
+            put_uint(buf, size[0])
+            put_uint(buf, size[1])
+            bits = int(walls.translate(WALL_BITS), 2)
+            delta = bits ^ self.walls if size == self.size else bits
+            buf.extend(delta.to_bytes((size[0]*size[1] + 7) // 8, 'little'))
+            self.size, self.walls = size, bits
+            if colored:
+                buf.extend(CODES[c] for c in walls if c != '0')
+
+        hero = snapshot['h']
+        buf.append(CODES[hero[0]])
+        for i in 1, 2, 3: put_int(buf, hero[i] - self.hero[i])
+        buf.append(hero[4] | hero[5] << 1)
+        self.hero = hero
+
+        for key, attr in ('e', 'enemies'), ('b', 'bullets'):
+            entities, previous = snapshot.get(key, []), getattr(self, attr)
+            put_uint(buf, len(entities))
+            for j, (c, x, y, angle) in enumerate(entities):
+                px, py, pa = previous[j][1:] if j < len(previous) else (0,)*3
+                buf.append(CODES[c])
+                put_int(buf, x - px)
+                put_int(buf, y - py)
+                put_int(buf, angle - pa)
+            setattr(self, attr, entities)
+
+    def decode(self, data, i):
+        """Return the snapshot encoded at data[i] and the index
+        after it.
+        """
+        flags, i = data[i], i + 1
+        snapshot = {}
+        delta, i = get_int(data, i)
+        self.score = snapshot['s'] = self.score + delta
+        if flags & 1: snapshot['t'], i = get_uint(data, i)
+
+        if flags & 2:
+            w, i = get_uint(data, i)
+            h, i = get_uint(data, i)
+            n = (w*h + 7) // 8
+            bits = int.from_bytes(data[i:i+n], 'little')
+            i += n
+            if (w, h) == self.size: bits ^= self.walls
+            self.size, self.walls = (w, h), bits
+            walls = format(bits, '0{}b'.format(w * h))
+            if flags & 4:
+                count = walls.count('1')
+                colors = iter(data[i:i+count])
+                i += count
+                walls = ''.join(COLOR_CODE[next(colors)] if c == '1' else c
+                                for c in walls)
+            else:
+                walls = walls.replace('1', WALL_CODE)
+            snapshot['m'] = [walls[j:j+w] for j in range(0, w*h, w)]
+
+        hero = [COLOR_CODE[data[i]]]
+        i += 1
+        for j in 1, 2, 3:
+            delta, i = get_int(data, i)
+            hero.append(self.hero[j] + delta)
+        hero.extend((data[i] & 1, data[i] >> 1))
+        i += 1
+        self.hero = snapshot['h'] = hero
+
+        for key, attr, flag in ('e', 'enemies', 8), ('b', 'bullets', 16):
+            count, i = get_uint(data, i)
+            previous, entities = getattr(self, attr), []
+            for j in range(count):
+                entity = [COLOR_CODE[data[i]]]
+                i += 1
+                for k, p in enumerate(previous[j][1:] if j < len(previous)
+                                      else (0,)*3):
+                    delta, i = get_int(data, i)
+                    entity.append(p + delta)
+                entities.append(entity)
+            if flags & flag: snapshot[key] = entities
+            setattr(self, attr, entities)
+        return snapshot, i
+
+
+class BinaryWriter(Writer):
+    """Writer streaming snapshots of a game to a binary record.
+
+    The record starts with MAGIC and a version byte, followed by
+    blocks of at most BLOCK_SIZE snapshots.  Each block is prefixed
+    by its length and compressed by zlib; inside, snapshots are
+    delta-encoded starting from an empty state, so that every block
+    is a keyframe which can be decoded independently.  Every block
+    is flushed as soon as it is written, hence a crash loses at most
+    one block.
+
+    Since version 2, a finished record ends with a zero block length,
+    an index of the start time (in ms, before the first snapshot)
+    and offset of every block, and TRAILER holding the offset
+    of the index and MAGIC.
+
+    Additional attributes:
+        block (bytearray): encoded snapshots of the current block
+        count (int): number of snapshots in the current block
+        codec (Codec): delta-encoding state of the current block
+        time (int): time of the last snapshot (in ms)
+        index (list of tuple of int): start time and offset of blocks
+    """
+    extension, mode = 'bmr', 'wb'
+
+    def open(self):
+        """Create the partial file and write the header."""
+        Writer.open(self)
+        self.file.write(MAGIC + bytes([VERSION]))
+        self.block, self.count, self.codec = bytearray(), 0, Codec()
+        self.time, self.index = 0, []
+
+    def dump(self, snapshot):
+        """Append the snapshot to the current block."""
+        if not self.count: self.index.append((self.time, None))
+        self.time += snapshot.get('t', 0)
+        self.codec.encode(self.block, snapshot)
+        self.count += 1
+        if self.count >= BLOCK_SIZE: self.flush()
+
+    def flush(self):
+        """Write the current block and start a new one."""
+        if not self.count: return
+        buf = bytearray()
+        put_uint(buf, self.count)
+        data = compress(bytes(buf + self.block), 9)
+        self.index[-1] = self.index[-1][0], self.file.tell()
+        self.file.write(BLOCK_HEADER.pack(len(data)) + data)
+        self.file.flush()
+        self.block, self.count, self.codec = bytearray(), 0, Codec()
+
+    def finalize(self):
+        """Write the last block and the index, then move the record
+        in place.
+        """
+        self.flush()
+        buf, time, offset = bytearray(), 0, 0
+        put_uint(buf, len(self.index))
+        for block_time, block_offset in self.index:
+            put_uint(buf, block_time - time)
+            put_uint(buf, block_offset - offset)
+            time, offset = block_time, block_offset
+        start = self.file.tell()
+        self.file.write(BLOCK_HEADER.pack(0) + buf
+                        + TRAILER.pack(start, MAGIC))
+        Writer.finalize(self)
+
+
+class InputWriter(Writer):
+    """Writer logging only the seed of a game and the controls
+    of its frames, from which simulate regenerates the snapshots.
+
+    The log has one JSON value per line: a header object holding
+    the seed, the frame rate, the size, the export rate and the hero's
+    angle the game starts with, followed by runs of identical frames,
+    each written as [count, fps, w, h, x, y, angle, firing, slashing],
+    the last five being the arguments of Maze.control with the
+    direction the hero took, left out for frames without control.
+
+    Additional attributes:
+        run (list): count and controls of the current run of frames
+    """
+    extension, mode = 'ndjson', 'w'
+
+    def __init__(self, filename, worker=None):
+        Writer.__init__(self, filename, worker)
+        self.run = []
+
+    def write(self, snapshot):
+        """Ignore the snapshot, which can be regenerated."""
+
+    def dump(self, value):
+        """Append the value as a line to the log."""
+        self.file.write(json.dumps(value, separators=JSON_SEPARATORS))
+        self.file.write('\n')
+
+    def log(self, maze, fps):
+        """Take note of the maze's controls before it is updated
+        at the given frame rate.
+        """
+        controls = [fps, maze.w, maze.h, *(maze.controls or ())]
+        if controls == self.run[1:]:
+            self.run[0] += 1
+            return
+        if self.run:
+            self.schedule(self.dump, self.run)
+        else:
+            self.start()
+            self.schedule(self.dump, {
+                'seed': maze.seed, 'fps': maze.fps, 'size': [maze.w, maze.h],
+                'rate': maze.export_rate, 'angle': maze.hero.angle})
+        self.run = [1, *controls]
+
+    def close(self):
+        """Schedule the last run to be written and the log
+        to be finalized.
+        """
+        if self.run: self.schedule(self.dump, self.run)
+        Writer.close(self)
+
+
+class Collector(list):
+    """List of snapshots which can stand in for a writer."""
+    write = list.append
+
+    def log(self, maze, fps): pass
+
+    def close(self): pass
+
+
+WRITERS = {'json': JSONWriter, 'binary': BinaryWriter, 'inputs': InputWriter}
+
+
+def load(filename):
+    """Return the list of snapshots in the given JSON record.
+
+    Records left unfinished by a crash are cut after their last
+    complete snapshot.
+    """
+    with open(filename) as f: text = f.read()
+    try:
+        return json.loads(text)
+    except ValueError:
+        # Snapshots are flat objects, so the last complete one
+        # ends with the last closing brace.
+        return json.loads('[{}]'.format(text[1:text.rfind('}')+1]))
+
+
+def simulate(filename):
+    """Yield snapshots regenerated by replaying the given input log
+    on a headless maze.
+
+    Snapshots are sampled at the recorded export rate, thus they may
+    be taken at slightly different frames from the ones exported
+    on request during the game.
+    """
+    from .maze import Maze  # which depends on this module
+    with open(filename) as f:
+        header = json.loads(f.readline())
+        maze = Maze(header['fps'], header['size'], True, '', header['rate'],
+                    seed=header['seed'])
+        maze.hero.angle, snapshots = header['angle'], Collector()
+        maze.writer = snapshots
+        for line in f:
+            count, fps, w, h, *controls = json.loads(line)
+            for _ in range(count):
+                # The game loop resizes after controlling, before updating.
+                if controls: maze.control(*controls)
+                if (w, h) != (maze.w, maze.h): maze.resize((w, h))
+                maze.update(fps)
+                yield from snapshots
+                snapshots.clear()
+
+
+def read_blocks(f):
+    """Yield snapshots from the blocks of the given binary file.
+
+    Stop at the index, the end of file or a block truncated by a crash.
+    """
+    while True:
+        header = f.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size: return
+        length, = BLOCK_HEADER.unpack(header)
+        if not length: return   # index
+        data = f.read(length)
+        if len(data) < length: return
+        data, codec = decompress(data), Codec()
+        count, i = get_uint(data, 0)
+        for _ in range(count):
+            snapshot, i = codec.decode(data, i)
+            yield snapshot
+
+
+def read(filename):
+    """Yield snapshots from the given record, which is either
+    JSON, binary or an input log.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic[:1] == b'{':
+            yield from simulate(filename)
+            return
+        if magic != MAGIC:
+            yield from load(filename)
+            return
+        check_version(f, filename)
+        yield from read_blocks(f)
+
+
+def check_version(f, filename):
+    """Read and return the version of a binary record, or raise
+    ValueError if it is not supported.
+    """
+    version = ord(f.read(1) or b'\0')
+    if not 1 <= version <= VERSION:
+        raise ValueError('{}: unsupported record version {}'.format(
+            filename, version))
+    return version
+
+
+class Record:
+    """Record opened for random access by time.
+
+    Binary records are only decoded from the keyframe before the time
+    sought, located using their index.  JSON records and binary ones
+    without an index, i.e. written before version 2 or cut short
+    by a crash, are loaded entirely.
+
+    Attributes:
+        filename (str): path to the record
+        file (io.BufferedReader): the opened binary record, None if
+            the record is loaded entirely
+        snapshots (list of dict): snapshots if loaded entirely
+        index (list of tuple of int): start time (in ms) and offset
+            (in bytes, or in snapshots if loaded entirely) of keyframes
+        times (list of int): start time of each keyframe
+        duration (int): time of the last snapshot (in ms)
+    """
+    def __init__(self, filename):
+        self.filename, self.file = filename, None
+        self.snapshots, self.index = [], []
+        with open(filename, 'rb') as f:
+            if (f.read(len(MAGIC)) == MAGIC
+                    and check_version(f, filename) >= 2):
+                f.seek(-TRAILER.size, SEEK_END)
+                start, magic = TRAILER.unpack(f.read(TRAILER.size))
+                if magic == MAGIC: self.read_index(f, start)
+
+        if self.index:
+            self.file = open(filename, 'rb')
+            self.times = [time for time, offset in self.index]
+            for self.duration, snapshot in self.seek(self.times[-1]): pass
+        else:
+            self.snapshots = list(read(filename))
+            self.times = [0]
+            self.times.extend(accumulate(snapshot.get('t', 0)
+                                         for snapshot in self.snapshots))
+            self.duration = self.times.pop()
+            self.index = [(time, i) for i, time in enumerate(self.times)]
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc_value, traceback): self.close()
+
+    def read_index(self, f, start):
+        """Read the index starting at the given offset."""
+        f.seek(start + BLOCK_HEADER.size)
+        data = f.read()
+        count, i = get_uint(data, 0)
+        time = offset = 0
+        for _ in range(count):
+            delta, i = get_uint(data, i)
+            time += delta
+            delta, i = get_uint(data, i)
+            offset += delta
+            self.index.append((time, offset))
+
+    def seek(self, time):
+        """Yield pairs of time (in ms) and snapshot, starting from
+        the last keyframe at or before the given time.
+        """
+        keyframe = max(bisect(self.times, time) - 1, 0)
+        if not self.index: return
+        start, offset = self.index[keyframe]
+        if self.file is None:
+            snapshots = self.snapshots[offset:]
+        else:
+            self.file.seek(offset)
+            snapshots = read_blocks(self.file)
+        for snapshot in snapshots:
+            start += snapshot.get('t', 0)
+            yield start, snapshot
+
+    def close(self):
+        """Close the record."""
+        if self.file is not None: self.file.close()
+
+
+def convert(filename, directory=None):
+    """Convert the given record to the binary format and return
+    the paths and sizes of the source and the result.
+    """
+    stem = path.splitext(filename)[0]
+    if directory is not None: stem = path.join(directory, path.basename(stem))
+    writer = BinaryWriter('{}.{}'.format(stem, BinaryWriter.extension))
+    writer.start()  # even if the record is empty
+    for snapshot in read(filename): writer.write(snapshot)
+    writer.close()
+    return (filename, path.getsize(filename),
+            writer.filename, path.getsize(writer.filename))
+
+
+def main():
+    """Convert JSON records to the binary format in parallel."""
+    parser = ArgumentParser(description='convert Brutal Maze JSON records'
+                            ' to the compact binary format')
+    parser.add_argument('records', nargs='+', metavar='RECORD',
+                        help='JSON records to be converted')
+    parser.add_argument(
+        '-o', '--output-dir', metavar='DIR',
+        help='directory to write to (fallback: next to the sources)')
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help='number of processes (fallback: CPU count)')
+    args = parser.parse_args()
+
+    total_src = total_dst = 0
+    with Pool(args.jobs) as pool:
+        jobs = ((record, args.output_dir) for record in args.records)
+        for src, src_size, dst, dst_size in pool.starmap(convert, jobs):
+            print('{} -> {} ({:.1f}x)'.format(src, dst, src_size / dst_size))
+            total_src += src_size
+            total_dst += dst_size
+    print('{} bytes -> {} bytes ({:.1f}x)'.format(
+        total_src, total_dst, total_src / (total_dst or 1)))
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,159 @@
+# render.py - module for rendering game records to videos
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for rendering game records to videos'
+
+from argparse import ArgumentParser
+from collections import deque
+from multiprocessing import Pool
+from os import cpu_count, environ, makedirs, path
+from shlex import split
+from subprocess import PIPE, Popen
+from sys import stdout
+
+from .records import Record
+
+CHUNK_SIZE = 60     # frames
+FRAME_NAME = '{:06d}.png'
+
+_record = None
+
+
+def open_record(filename):
+    """Open the record to be rendered by the current process."""
+    global _record
+    _record = Record(filename)
+
+
+def frames(start, stop, size, fps):
+    """Yield the surface drawn with each frame in the given range,
+    reusing the same surface.
+    """
+    # Pygame is imported lazily so that main can silence it first.
+    import pygame
+    from .replay import draw
+    surface, grid = pygame.Surface(size), (1, 1)
+    snapshots = _record.seek(start * 1000 / fps)
+    current, following = next(snapshots, None), next(snapshots, None)
+    if current is None: return
+    for i in range(start, stop):
+        time = i * 1000 / fps
+        while following is not None and following[0] <= time:
+            # Skipped snapshots still tell the size of hidden maps.
+            rows = current[1].get('m')
+            if rows: grid = len(rows[0]), len(rows)
+            current, following = following, next(snapshots, None)
+        grid = draw(surface, current[1], grid)
+        yield surface
+
+
+def render_png(start, stop, size, fps, directory):
+    """Save the frames in the given range as PNG images inside
+    the directory and return the number of saved frames.
+    """
+    from pygame.image import save
+    for i, surface in enumerate(frames(start, stop, size, fps), start):
+        save(surface, path.join(directory, FRAME_NAME.format(i)))
+    return stop - start
+
+
+def render_raw(start, stop, size, fps):
+    """Return the frames in the given range as raw RGB24 pixels."""
+    from pygame.image import tostring
+    return b''.join(tostring(surface, 'RGB')
+                    for surface in frames(start, stop, size, fps))
+
+
+def render(filename, size, fps, output, jobs=None, chunk_size=CHUNK_SIZE):
+    """Render the record offscreen to the output in parallel.
+
+    output is either a directory to save a PNG sequence to or a
+    writable binary file for raw frames, e.g. an encoder's stdin.
+    The timeline is split into chunks of chunk_size frames, rendered
+    by jobs processes and written in order.  Return the number of
+    rendered frames.
+    """
+    with Record(filename) as record: duration = record.duration
+    total = int(duration * fps / 1000) + 1
+    chunks = [(start, min(start + chunk_size, total), size, fps)
+              for start in range(0, total, chunk_size)]
+    with Pool(jobs, open_record, (filename,)) as pool:
+        if isinstance(output, str):
+            makedirs(output, exist_ok=True)
+            return sum(pool.starmap(render_png, [(*chunk, output)
+                                                 for chunk in chunks]))
+        # Only a few chunks are kept in memory while waiting
+        # for the earlier ones to be written.
+        pending, chunks = deque(), iter(chunks)
+        for chunk in chunks:
+            pending.append(pool.apply_async(render_raw, chunk))
+            if len(pending) >= (jobs or cpu_count() or 1) * 2: break
+        while pending:
+            output.write(pending.popleft().get())
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(pool.apply_async(render_raw, chunk))
+    return total
+
+
+def main():
+    """Render records offscreen to PNG sequences or raw frames."""
+    parser = ArgumentParser(
+        description='render Brutal Maze records offscreen to PNG sequences'
+        ' or raw RGB24 frames')
+    parser.add_argument('record', metavar='RECORD',
+                        help='record to be rendered, in any format')
+    parser.add_argument('-s', '--size', type=int, nargs=2, default=(640, 480),
+                        metavar=('X', 'Y'),
+                        help='size of frames (fallback: 640x480)')
+    parser.add_argument('-r', '--fps', type=float, default=30.0,
+                        help='frame rate of the video (fallback: 30)')
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help='number of processes (fallback: CPU count)')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('-o', '--output-dir', metavar='DIR',
+                        help='directory to save the PNG sequence to')
+    output.add_argument('--raw', action='store_true',
+                        help='write raw frames to stdout')
+    output.add_argument(
+        '-e', '--encoder', metavar='COMMAND',
+        help='command to pipe raw frames to, where {width}, {height}'
+        ' and {fps} are substituted, e.g. "ffmpeg -f rawvideo -pix_fmt rgb24'
+        ' -s {width}x{height} -r {fps} -i - out.mp4"')
+    args = parser.parse_args()
+
+    # Surfaces are drawn without a display, but just in case
+    # something asks SDL for one.  Raw frames written to stdout
+    # must not be preceded by Pygame's greeting either.
+    environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    size = tuple(args.size)
+    if args.output_dir is not None:
+        render(args.record, size, args.fps, args.output_dir, args.jobs)
+    elif args.raw:
+        render(args.record, size, args.fps, stdout.buffer, args.jobs)
+    else:
+        width, height = size
+        command = split(args.encoder.format(width=width, height=height,
+                                            fps=args.fps))
+        with Popen(command, stdin=PIPE) as encoder:
+            render(args.record, size, args.fps, encoder.stdin, args.jobs)
+        if encoder.returncode: exit(encoder.returncode)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,183 @@
+# replay.py - module for replaying game records
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for replaying game records'
+
+from math import pi, radians
+
+import pygame
+from pygame import (K_DOWN, K_END, K_HOME, K_LEFT, K_RIGHT, K_SPACE, K_UP,
+                    KEYDOWN, MOUSEBUTTONDOWN, MOUSEMOTION, QUIT, VIDEORESIZE)
+from pygame.time import Clock
+
+from .constants import BG_COLOR, COLORS, FG_COLOR, SQRT2
+from .misc import regpoly, fill_aapolygon
+from .records import Record
+
+RGB = {code: color for color, code in COLORS.items()}
+HERO_RATIO = 2 / 27**0.25   # circumradius of the hero per grid
+SEEK_STEP = 5000    # ms
+MIN_SPEED, MAX_SPEED = 1 / 8, 16
+BAR_HEIGHT = 4  # px
+
+
+def draw(surface, snapshot, grid):
+    """Draw the snapshot onto the surface.
+
+    grid is the number of columns and rows of the map, which is
+    used if the snapshot does not contain the map.  Return the
+    number of columns and rows drawn.
+    """
+    w, h = surface.get_size()
+    rows = snapshot.get('m')
+    if rows: grid = len(rows[0]), len(rows)
+    unit = min(w / (grid[0]+1), h / (grid[1]+1))
+    hero = snapshot['h']
+    x0, y0 = w/2 - hero[1]/100*unit, h/2 - hero[2]/100*unit
+
+    surface.fill(BG_COLOR)
+    for row, line in enumerate(rows or ()):
+        for column, code in enumerate(line):
+            if code == '0': continue
+            square = regpoly(4, unit / SQRT2, pi / 4,
+                             x0 + (column+0.5)*unit, y0 + (row+0.5)*unit)
+            fill_aapolygon(surface, square, RGB[code])
+    for code, x, y, angle in snapshot.get('e', ()):
+        square = regpoly(4, unit / SQRT2, radians(angle),
+                         x0 + x/100*unit, y0 + y/100*unit)
+        fill_aapolygon(surface, square, RGB[code])
+    trigon = regpoly(4 - hero[5], unit * HERO_RATIO, radians(hero[3]),
+                     w / 2, h / 2)
+    fill_aapolygon(surface, trigon, RGB[hero[0]])
+    for code, x, y, angle in snapshot.get('b', ()):
+        pentagon = regpoly(5, unit / 4, radians(angle),
+                           x0 + x/100*unit, y0 + y/100*unit)
+        fill_aapolygon(surface, pentagon, RGB[code])
+    return grid
+
+
+class Replay:
+    """Object replaying a record in a Pygame window.
+
+    Space toggles pause, left and right arrows seek SEEK_STEP back
+    and forth, up and down arrows double and halve the speed, Home
+    and End jump to the beginning and the end of the record and
+    dragging the progress bar at the bottom scrubs through it.
+
+    Attributes:
+        record (records.Record): the record being replayed
+        surface (pygame.Surface): the display to draw on
+        fps (float): maximum frame rate
+        clock (pygame.time.Clock): clock ticking frames
+        time (float): current replay time (in ms)
+        speed (float): replay speed relative to real time
+        paused (bool): flag indicating if the replay is paused
+        snapshots (iterator): pairs of time and snapshot to be shown
+        current, next (tuple): the shown and the next pair
+        grid (tuple of int): number of columns and rows of the map
+    """
+    def __init__(self, filename, size, fps):
+        self.record = Record(filename)
+        pygame.display.init()
+        self.surface = pygame.display.set_mode(size, pygame.RESIZABLE)
+        self.fps, self.clock = fps, Clock()
+        self.speed, self.paused, self.grid = 1.0, False, (1, 1)
+        self.seek(0)
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.record.close()
+        pygame.quit()
+
+    def seek(self, time):
+        """Jump to the given time (in ms)."""
+        self.time = min(max(time, 0), self.record.duration)
+        self.snapshots = self.record.seek(self.time)
+        self.current = self.next = next(self.snapshots, None)
+        self.advance()
+
+    def advance(self):
+        """Move to the last snapshot not later than the current time."""
+        while self.next is not None and self.next[0] <= self.time:
+            self.current, self.next = self.next, next(self.snapshots, None)
+
+    def scrub(self, x):
+        """Seek to the time corresponding to the given abscissa
+        on the progress bar.
+        """
+        self.seek(x / self.surface.get_width() * self.record.duration)
+
+    def draw(self):
+        """Draw the current snapshot and the progress bar."""
+        if self.current is None: return
+        time, snapshot = self.current
+        self.grid = draw(self.surface, snapshot, self.grid)
+        w, h = self.surface.get_size()
+        progress = self.time / (self.record.duration or 1)
+        pygame.draw.rect(self.surface, FG_COLOR,
+                         (0, h - BAR_HEIGHT, round(w * progress), BAR_HEIGHT))
+        pygame.display.flip()
+        pygame.display.set_caption(
+            'Brutal Maze replay - Score: {} - {:.0f}/{:.0f}s - {}x{}'.format(
+                snapshot['s'], self.time / 1000, self.record.duration / 1000,
+                self.speed, ' (paused)' if self.paused else ''))
+
+    def update(self):
+        """Handle events and draw the next frame.
+
+        Return False if QUIT event is captured, True otherwise.
+        """
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                return False
+            elif event.type == VIDEORESIZE:
+                self.surface = pygame.display.set_mode(
+                    (event.w, event.h), pygame.RESIZABLE)
+            elif event.type == KEYDOWN:
+                if event.key == K_SPACE:
+                    self.paused ^= True
+                elif event.key == K_LEFT:
+                    self.seek(self.time - SEEK_STEP)
+                elif event.key == K_RIGHT:
+                    self.seek(self.time + SEEK_STEP)
+                elif event.key == K_UP:
+                    self.speed = min(self.speed * 2, MAX_SPEED)
+                elif event.key == K_DOWN:
+                    self.speed = max(self.speed / 2, MIN_SPEED)
+                elif event.key == K_HOME:
+                    self.seek(0)
+                elif event.key == K_END:
+                    self.seek(self.record.duration)
+            elif event.type == MOUSEBUTTONDOWN:
+                self.scrub(event.pos[0])
+            elif event.type == MOUSEMOTION and event.buttons[0]:
+                self.scrub(event.pos[0])
+
+        delta = self.clock.tick(self.fps)
+        if not self.paused and self.time < self.record.duration:
+            self.time = min(self.time + delta*self.speed, self.record.duration)
+            self.advance()
+        self.draw()
+        return True
+
+
+def replay(filename, size, fps):
+    """Replay the given record until the window is closed."""
+    with Replay(filename, size, fps) as viewer:
+        while viewer.update(): pass
@@ -0,0 +1,238 @@
+# stats.py - module for analyzing game records
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for analyzing game records'
+
+import json
+import sqlite3
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import datetime
+from multiprocessing import Pool
+from os import makedirs, path, walk
+from statistics import median
+
+from .constants import COLORS, ENEMIES, HERO_HP, JSON_SEPARATORS, TANGO
+from .records import PARTIAL_SUFFIX, WRITERS, read
+
+EXTENSIONS = {'.' + writer.extension for writer in WRITERS.values()}
+ENEMY_NAMES = {COLORS[color]: name for name in ENEMIES
+               for color in TANGO[name]}
+HERO_WOUNDS = {COLORS[color]: wound
+               for wound, color in enumerate(TANGO['Aluminium'])}
+LOW_HP = HERO_HP - 2    # wound from which the hero is about to die
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    started TEXT,           -- local time the game started
+    duration INTEGER,       -- ms
+    score INTEGER,
+    snapshots INTEGER,
+    max_enemies INTEGER,
+    low_hp INTEGER,         -- ms spent with at most two HP left
+    curve TEXT              -- JSON array of [time, score] at each change
+);
+CREATE TABLE IF NOT EXISTS kills (
+    path TEXT REFERENCES games (path) ON DELETE CASCADE,
+    enemy TEXT,
+    count INTEGER,
+    PRIMARY KEY (path, enemy)
+);
+CREATE INDEX IF NOT EXISTS games_started ON games (started);
+'''
+
+
+def started(filename):
+    """Return the local time a game started as named by json_rec
+    in SQLite's format, or None if the file is not named so.
+    """
+    stem = path.basename(filename).split('.')[0]
+    try:
+        return datetime.strptime(stem, '%Y-%m-%dT%H:%M:%S').isoformat(' ')
+    except ValueError:
+        return None
+
+
+def analyze(filename):
+    """Return the metrics of the game in the given record.
+
+    Kills are estimated from the enemies which disappear
+    between two snapshots while the score increases.
+    """
+    time = score = snapshots = max_enemies = low_hp = 0
+    curve, kills, enemies = [[0, 0]], Counter(), Counter()
+    for snapshot in read(filename):
+        delta = snapshot.get('t', 0)
+        time += delta
+        snapshots += 1
+        if HERO_WOUNDS.get(snapshot['h'][0], HERO_HP) >= LOW_HP:
+            low_hp += delta
+        seen = Counter(ENEMY_NAMES.get(e[0]) for e in snapshot.get('e', ()))
+        max_enemies = max(max_enemies, sum(seen.values()))
+        if snapshot['s'] != score:
+            if snapshot['s'] > score: kills.update(enemies - seen)
+            score = snapshot['s']
+            curve.append([time, score])
+        enemies = seen
+    kills.pop(None, None)
+    return {'path': path.abspath(filename), 'mtime': path.getmtime(filename),
+            'started': started(filename), 'duration': time, 'score': score,
+            'snapshots': snapshots, 'max_enemies': max_enemies,
+            'low_hp': low_hp, 'kills': dict(kills),
+            'curve': json.dumps(curve, separators=JSON_SEPARATORS)}
+
+
+def safe_analyze(filename):
+    """Return the metrics of the given record, or the error
+    message if it is unreadable.
+    """
+    try:
+        return analyze(filename)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        return '{}: {}'.format(filename, e)
+
+
+def find(paths):
+    """Yield absolute paths to finished records in the given files
+    and directories.
+    """
+    for name in paths:
+        if not path.isdir(name):
+            yield path.abspath(name)
+            continue
+        for root, dirs, files in walk(name):
+            for file in files:
+                if file.endswith(PARTIAL_SUFFIX): continue
+                if path.splitext(file)[1] in EXTENSIONS:
+                    yield path.abspath(path.join(root, file))
+
+
+class Catalog:
+    """SQLite catalog of game metrics, keyed by the records' paths
+    and updated only for new or modified records.
+
+    Attributes:
+        connection (sqlite3.Connection): connection to the database
+    """
+    def __init__(self, database):
+        self.connection = sqlite3.connect(database)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc_value, traceback): self.close()
+
+    def outdated(self, filenames):
+        """Return the given records not yet cataloged
+        or modified since.
+        """
+        mtimes = dict(self.connection.execute('SELECT path, mtime FROM games'))
+        return [filename for filename in filenames
+                if mtimes.get(filename) != path.getmtime(filename)]
+
+    def update(self, paths, jobs=None):
+        """Catalog new and modified records in the given paths using
+        a pool of processes.  Return the number of cataloged records
+        and the list of errors.
+        """
+        count, errors = 0, []
+        filenames = self.outdated(find(paths))
+        if not filenames: return count, errors
+        with Pool(jobs) as pool, self.connection:
+            for result in pool.imap_unordered(safe_analyze, filenames):
+                if isinstance(result, str):
+                    errors.append(result)
+                    continue
+                self.insert(result)
+                count += 1
+        return count, errors
+
+    def insert(self, metrics):
+        """Insert or replace the metrics of a game."""
+        execute = self.connection.execute
+        execute('DELETE FROM games WHERE path = ?', (metrics['path'],))
+        execute('INSERT INTO games VALUES (:path, :mtime, :started, :duration,'
+                ' :score, :snapshots, :max_enemies, :low_hp, :curve)', metrics)
+        self.connection.executemany(
+            'INSERT INTO kills VALUES (?, ?, ?)',
+            ((metrics['path'], enemy, count)
+             for enemy, count in metrics['kills'].items()))
+
+    def summary(self, since=None):
+        """Return a summary of the games started since the given
+        time, in SQLite's format, or of all games.
+        """
+        where, params = ('WHERE started >= ?', (since,)) if since else ('', ())
+        scores = [score for score, in self.connection.execute(
+            'SELECT score FROM games {} ORDER BY score'.format(where), params)]
+        duration, low_hp = self.connection.execute(
+            'SELECT total(duration), total(low_hp) FROM games ' + where,
+            params).fetchone()
+        kills = self.connection.execute(
+            'SELECT enemy, sum(count) FROM kills JOIN games USING (path) {}'
+            ' GROUP BY enemy ORDER BY sum(count) DESC'.format(where), params)
+        return {'games': len(scores),
+                'median score': median(scores) if scores else None,
+                'best score': scores[-1] if scores else None,
+                'hours played': round(duration / 3600000, 2),
+                'time at low HP': round(low_hp / (duration or 1), 3),
+                'kills': dict(kills)}
+
+    def close(self):
+        """Close the connection to the database."""
+        self.connection.close()
+
+
+def main():
+    """Catalog records and print statistics."""
+    from appdirs import user_data_dir
+    database = path.join(user_data_dir('brutalmaze', False), 'stats.sqlite3')
+    parser = ArgumentParser(description='catalog Brutal Maze records'
+                            ' and print statistics of the games')
+    parser.add_argument('paths', nargs='*', metavar='PATH',
+                        help='records or directories to catalog')
+    parser.add_argument(
+        '-d', '--database', default=database, metavar='PATH',
+        help='SQLite catalog to update (fallback: {})'.format(database))
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help='number of processes (fallback: CPU count)')
+    parser.add_argument('--since', metavar='TIME',
+                        help='only summarize games started since the given'
+                        ' local time, e.g. 2020-01-31 or "2020-01-31 13:00"')
+    parser.add_argument('--sql', metavar='QUERY',
+                        help='run the query on the catalog instead of'
+                        ' summarizing, e.g. "SELECT path, score FROM games'
+                        ' ORDER BY score DESC LIMIT 10"')
+    args = parser.parse_args()
+
+    makedirs(path.dirname(path.abspath(args.database)), exist_ok=True)
+    with Catalog(args.database) as catalog:
+        count, errors = catalog.update(args.paths, args.jobs)
+        for error in errors: print('skipped', error)
+        if count: print('cataloged', count, 'records')
+        if args.sql is None:
+            for key, value in catalog.summary(args.since).items():
+                print('{}: {}'.format(key, value))
+        else:
+            for row in catalog.connection.execute(args.sql):
+                print(*row, sep='\t')
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,172 @@
+# tournament.py - module for running tournaments of bots
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for running tournaments of bots'
+
+import json
+import re
+from argparse import ArgumentParser
+from itertools import product
+from multiprocessing.pool import ThreadPool
+from os import environ
+from random import Random
+from shlex import split
+from socket import socket
+from statistics import mean
+from subprocess import DEVNULL, PIPE, Popen
+from sys import executable
+from threading import Timer
+
+HOST = 'localhost'
+SCORE = re.compile(r'scored (\d+) points in (\d+)ms')
+TIMEOUT = 600.0     # s
+RESAMPLES = 2000
+CONFIDENCE = 0.95
+
+
+def free_port(host=HOST):
+    """Return a port on the host which is free at the moment."""
+    with socket() as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+def play(job):
+    """Play a game on a new headless server seeded by the given seed
+    with the bot command, in which {port} is substituted.
+
+    Return the bot, the seed, the score and the survival time (in ms),
+    the last two being None if the game did not finish in time.
+    """
+    bot, seed, max_fps, timeout = job
+    port = free_port()
+    command = [executable, '-m', 'brutalmaze.game', '--server', '--headless',
+               '--host', HOST, '--port', str(port), '--seed', str(seed)]
+    if max_fps is not None: command.extend(('--max-fps', str(max_fps)))
+    server = Popen(command, stdout=PIPE, stderr=DEVNULL,
+                   universal_newlines=True,
+                   env=dict(environ, PYTHONUNBUFFERED='1'))
+    client = None
+    # Killing the server ends its output and thus the game.
+    timer = Timer(timeout, server.kill)
+    timer.start()
+    try:
+        for line in server.stdout:
+            if line.startswith('Socket server is listening'): break
+        client = Popen(split(bot.format(port=port)),
+                       stdout=DEVNULL, stderr=DEVNULL)
+        for line in server.stdout:
+            match = SCORE.search(line)
+            if match is not None:
+                return bot, seed, int(match.group(1)), int(match.group(2))
+        return bot, seed, None, None
+    finally:
+        timer.cancel()
+        for process in server, client:
+            if process is None: continue
+            process.kill()
+            process.wait()
+        server.stdout.close()
+
+
+def interval(values, rng, confidence=CONFIDENCE, resamples=RESAMPLES):
+    """Return the bootstrap confidence interval of the values' mean."""
+    if len(values) < 2: return (values[0],) * 2 if values else (None, None)
+    means = sorted(mean(rng.choices(values, k=len(values)))
+                   for _ in range(resamples))
+    tail = (1 - confidence) / 2
+    return means[int(resamples * tail)], means[int(resamples * (1-tail)) - 1]
+
+
+def leaderboard(results, seed=0):
+    """Return the statistics of each bot from the results of games,
+    sorted by mean score.
+    """
+    games = {}
+    for bot, _, score, time in results:
+        games.setdefault(bot, []).append((score, time))
+    board, rng = [], Random(seed)
+    for bot, played in games.items():
+        finished = [(score, time / 1000) for score, time in played
+                    if score is not None]
+        scores = [score for score, time in finished]
+        times = [time for score, time in finished]
+        board.append({'bot': bot, 'games': len(scores),
+                      'unfinished': len(played) - len(scores),
+                      'score': mean(scores) if scores else None,
+                      'score CI': interval(scores, rng),
+                      'survival': mean(times) if times else None,
+                      'survival CI': interval(times, rng)})
+    board.sort(key=lambda row: -1 if row['score'] is None else row['score'],
+               reverse=True)
+    return board
+
+
+def main():
+    """Play every bot on every seed and print the leaderboard."""
+    parser = ArgumentParser(description='play bots against headless'
+                            ' Brutal Maze servers and rank them')
+    parser.add_argument('bots', nargs='+', metavar='COMMAND',
+                        help='command running a bot, in which {port}'
+                        ' is substituted, e.g. "python3 hit-and-run.py'
+                        ' {port}"')
+    parser.add_argument('-s', '--seeds', type=int, nargs='+',
+                        default=range(10), metavar='SEED',
+                        help='seeds of the servers (fallback: 0 to 9)')
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help='number of concurrent games'
+                        ' (fallback: CPU count)')
+    parser.add_argument('-f', '--max-fps', type=int, metavar='FPS',
+                        help="servers' maximum FPS (fallback: configured)")
+    parser.add_argument('-t', '--timeout', type=float, default=TIMEOUT,
+                        metavar='SECONDS', help='time after which a game'
+                        ' is abandoned (fallback: {})'.format(TIMEOUT))
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='also write results of every game as JSON')
+    args = parser.parse_args()
+
+    jobs = [(bot, seed, args.max_fps, args.timeout)
+            for seed, bot in product(args.seeds, args.bots)]
+    results = []
+    # Games are processes of their own, so threads are enough
+    # to keep a game running on each core.
+    with ThreadPool(args.jobs) as pool:
+        for result in pool.imap_unordered(play, jobs):
+            print('{}: seed {}, score {}, {} ms'.format(*result), flush=True)
+            results.append(result)
+
+    line = '{:>4} {:>5} {:>8} {:>8} {:>15} {:>12} {:>17}  {}'
+    print(line.format('rank', 'games', 'timeouts', 'score', '95% CI',
+                      'survival (s)', '95% CI', 'bot'))
+    for rank, row in enumerate(leaderboard(results), 1):
+        if row['games']:
+            stats = ('{:.1f}'.format(row['score']),
+                     '{:.1f}-{:.1f}'.format(*row['score CI']),
+                     '{:.1f}'.format(row['survival']),
+                     '{:.1f}-{:.1f}'.format(*row['survival CI']))
+        else:
+            stats = '-', '-', '-', '-'
+        print(line.format(rank, row['games'], row['unfinished'], *stats,
+                          row['bot']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump([dict(zip(('bot', 'seed', 'score', 'time'), result))
+                       for result in results], f, indent=2)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,71 @@
+# worker.py - module for background work
+# Copyright (C) 2017-2020  Nguyễn Gia Phong
+#
+# This file is part of Brutal Maze.
+#
+# Brutal Maze is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Brutal Maze is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Brutal Maze.  If not, see <https://www.gnu.org/licenses/>.
+
+__doc__ = 'Brutal Maze module for background work'
+
+from queue import Full, Queue
+from threading import Thread
+from traceback import print_exc
+
+
+class Worker:
+    """Daemon thread calling submitted functions in order,
+    keeping blocking work off the main loop.
+
+    Attributes:
+        queue (Queue): bounded queue of pending calls
+        thread (Thread): the thread doing the work
+    """
+    def __init__(self, maxsize=64, name=None):
+        self.queue = Queue(maxsize)
+        self.thread = Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Call submitted functions until the worker is closed."""
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None: break
+                func, args = task
+                func(*args)
+            except Exception:
+                print_exc()
+            finally:
+                self.queue.task_done()
+
+    def submit(self, func, *args, block=True):
+        """Schedule func(*args) to be called in the background.
+
+        If block is False and the queue is full, the call is dropped.
+        Return whether it is scheduled.
+        """
+        try:
+            self.queue.put((func, args), block)
+        except Full:
+            return False
+        return True
+
+    def flush(self):
+        """Wait until all scheduled calls are done."""
+        self.queue.join()
+
+    def close(self):
+        """Finish all scheduled calls and stop the thread."""
+        self.queue.put(None)
+        self.thread.join()
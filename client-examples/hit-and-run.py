@@ -3,6 +3,7 @@ from contextlib import closing, suppress
 from math import inf, atan2, degrees
 from random import randrange, shuffle
 from socket import socket
+from sys import argv
 
 AROUND = [5, 2, 1, 0, 3, 6, 7, 8]
 
@@ -37,7 +38,7 @@ def get_move(maze, move):
 
 
 with suppress(KeyboardInterrupt), closing(socket()) as sock:
-    sock.connect(('localhost', 42069))
+    sock.connect(('localhost', int(argv[1]) if len(argv) > 1 else 42069))
     move = 4
     while True:
         length = sock.recv(7).decode()